@@ -0,0 +1,352 @@
+import itertools
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import (
+    Any, Callable, Dict, Hashable, NamedTuple, Optional, Union
+)
+
+import models
+
+MISSING = object()
+NOT_FOUND = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a time to live.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum amount of entries kept in memory. The least recently used
+        entry is evicted when this limit is exceeded.
+    ttl : float
+        Default time to live of each entry, in seconds.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = MISSING,
+            count: bool = True) -> Any:
+        """Return the value of `key`, or `default`. Lookups only count as
+        hits or misses with `count`."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += count
+                    return value
+                del self._data[key]
+            self.misses += count
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+class DiskStore:
+    """SQLite store of PokeAPI lookups that survives restarts.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file.
+    """
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS pokemon ("
+                "number INTEGER PRIMARY KEY, data TEXT, expires_at REAL)"
+            )
+
+    def get(self, number: int) -> Any:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data, expires_at FROM pokemon WHERE number = ?",
+                (number,)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return MISSING
+        if row[0] is None:
+            return NOT_FOUND
+        return models.Pokemon.parse_raw(row[0])
+
+    def set(self, number: int, pokemon: Union[models.Pokemon, object],
+            ttl: float):
+        data = None if pokemon is NOT_FOUND else pokemon.json()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pokemon VALUES (?, ?, ?)",
+                (number, data, time.time() + ttl)
+            )
+
+
+class PokemonCache:
+    """Two level cache for PokeAPI lookups, with negative caching.
+
+    Lookups are served from an in-process LRU first and from the optional
+    disk store second. IDs that do not exist on the PokeAPI are cached as
+    ``NOT_FOUND`` with their own, usually shorter, time to live.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum amount of pokemon kept in memory.
+    ttl : float
+        Time to live of a found pokemon, in seconds.
+    negative_ttl : float
+        Time to live of a pokemon ID that was not found, in seconds.
+    path : str, optional
+        Path of the SQLite file used as disk store. Disabled if not given.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 86400.0,
+                 negative_ttl: float = 3600.0, path: Optional[str] = None):
+        self.memory = TTLCache(maxsize, ttl)
+        self.disk = DiskStore(path) if path else None
+        self.negative_ttl = negative_ttl
+        self.disk_hits = 0
+        self.negative_hits = 0
+
+    def get(self, number: int, count: bool = True) -> Any:
+        """Return the cached pokemon, ``NOT_FOUND`` or ``MISSING``.
+
+        Lookups without `count`, e.g. checking again for a lookup already
+        counted, leave the hit and miss counters untouched.
+        """
+        value = self.memory.get(number, count=count)
+        if value is MISSING and self.disk is not None:
+            value = self.disk.get(number)
+            if value is not MISSING:
+                self.disk_hits += count
+                self._remember(number, value)
+        if value is NOT_FOUND:
+            self.negative_hits += count
+        return value
+
+    def set(self, number: int, pokemon: Union[models.Pokemon, object]):
+        ttl = self._remember(number, pokemon)
+        if self.disk is not None:
+            self.disk.set(number, pokemon, ttl)
+
+    def _remember(self, number: int, pokemon: Any) -> float:
+        ttl = self.negative_ttl if pokemon is NOT_FOUND else self.memory.ttl
+        self.memory.set(number, pokemon, ttl)
+        return ttl
+
+    def stats(self) -> dict:
+        stats = self.memory.stats()
+        stats["disk_hits"] = self.disk_hits
+        stats["negative_hits"] = self.negative_hits
+        return stats
+
+
+class SingleFlight:
+    """Share a single call between concurrent callers with the same key.
+
+    The first caller for a key runs the call, and callers arriving while it
+    is in flight wait for its result, or its exception, instead of making
+    the same call again.
+
+    Parameters
+    ----------
+    timeout : float, optional
+        Seconds a waiting caller waits for the result before raising
+        ``TimeoutError``. Waits indefinitely if not given.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self.calls = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        """Return ``func(*args, **kwargs)``, sharing the call in flight for
+        `key` if there is one."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                return future.result(self.timeout)
+            except FutureTimeoutError:
+                with self._lock:
+                    self.timeouts += 1
+                raise TimeoutError(
+                    f"Timed out waiting for the call in flight for '{key}'.")
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._in_flight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts
+        }
+
+
+class Cached(NamedTuple):
+    """A cached value, with a tag that changes whenever it is reloaded."""
+    etag: str
+    value: Any
+
+
+class _Group:
+    """Values of a group, tagged with the generation they were loaded in."""
+
+    __slots__ = ("generation", "values")
+
+    def __init__(self):
+        self.generation = 0
+        self.values: OrderedDict = OrderedDict()
+
+
+class GroupedCache:
+    """Read-through cache of values invalidated by group, e.g. by trainer.
+
+    Each value is stored under a group and a key, and loaded on a miss. All
+    the values of a group are invalidated at once, by moving the group to a
+    new generation, and values loaded while their group is being
+    invalidated are not cached, so a reader never caches data older than
+    the last invalidation. Exceptions raised by the loader are not cached.
+
+    Every load that changes a value gets a new tag, unique across restarts,
+    which can serve as an HTTP ETag of the value. Values that are loaded
+    again unchanged, e.g. after an invalidation by a write to another part of
+    the group, keep their tag, so clients still get ``304 Not Modified``.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum amount of groups kept in memory.
+    ttl : float
+        Time to live of each value, in seconds.
+    group_maxsize : int
+        Maximum amount of values kept per group.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0,
+                 group_maxsize: int = 32):
+        self.ttl = ttl
+        self.group_maxsize = group_maxsize
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._groups = TTLCache(maxsize, float("inf"))
+        self._counter = itertools.count(1)
+        self._tag_prefix = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+
+    def get(self, group: Hashable, key: Hashable,
+            loader: Callable[[], Any]) -> Cached:
+        """Return the cached value of `key` in `group`, or load it."""
+        now = time.monotonic()
+        with self._lock:
+            values = self._groups.get(group)
+            if values is MISSING:
+                values = _Group()
+                self._groups.set(group, values)
+            entry = values.values.get(key)
+            if entry is not None and entry[1] > now and \
+                    entry[2] == values.generation:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = values.generation
+
+        value = loader()
+
+        with self._lock:
+            previous = values.values.get(key)
+            if previous is not None and previous[0].value == value:
+                cached = previous[0]
+            else:
+                counter = next(self._counter)
+                cached = Cached(f'"{self._tag_prefix}-{counter}"', value)
+            # Not cached if the group was invalidated, or evicted, during the
+            # load.
+            if values.generation == generation and \
+                    self._groups.get(group) is values:
+                values.values[key] = (
+                    cached, time.monotonic() + self.ttl, generation)
+                values.values.move_to_end(key)
+                while len(values.values) > self.group_maxsize:
+                    values.values.popitem(last=False)
+        return cached
+
+    def invalidate(self, group: Hashable):
+        """Invalidate every value of `group`, including the ones being
+        loaded."""
+        with self._lock:
+            self.invalidations += 1
+            values = self._groups.get(group)
+            if values is not MISSING:
+                values.generation += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "groups": len(self._groups),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "invalidations": self.invalidations
+        }
@@ -0,0 +1,40 @@
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import tracing
+
+IO_WORKERS = int(os.environ.get("API_IO_WORKERS", 32))
+
+_executor = ThreadPoolExecutor(
+    max_workers=IO_WORKERS, thread_name_prefix="mpa-io"
+)
+
+
+async def run_io(func, *args, **kwargs):
+    """Run a blocking call on the I/O thread pool.
+
+    The event loop keeps serving other requests while `func` waits on the
+    PokeAPI or Firestore. At most ``API_IO_WORKERS`` calls run at once.
+    The call runs in a copy of the current context, so it is part of the
+    trace of the request, where the time spent waiting for a free thread is
+    added to the ``io_queue`` phase.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _executor, context.run,
+        partial(_timed_call, time.perf_counter(), func, *args, **kwargs)
+    )
+
+
+def _timed_call(submit_time: float, func, *args, **kwargs):
+    tracing.add("io_queue", time.perf_counter() - submit_time)
+    return func(*args, **kwargs)
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
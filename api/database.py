@@ -1,30 +1,75 @@
 import os
+import random
 from datetime import datetime
-
-import firebase_admin
-import requests
-from firebase_admin import credentials, firestore
-from google.cloud.firestore_v1.base_document import DocumentSnapshot
+from typing import Dict, List, Optional, Union
 
 import models
-
-credentials_path = "serviceAccountKey.json"
-if os.path.exists(credentials_path):
-    credentials = credentials.Certificate(credentials_path)
-    firestore_app = firebase_admin.initialize_app(
-        credentials,
-        options={"projectId": "hotaru-gcp"}
-    )
-else:
-    firestore_app = firebase_admin.initialize_app(
-        options={"projectId": "hotaru-gcp"}
-    )
-db = firestore.client(firestore_app)
+import storage
+from cache import (
+    MISSING, NOT_FOUND, Cached, GroupedCache, PokemonCache, SingleFlight
+)
+from concurrency import IO_WORKERS
+from pokedex import LAST_POKEMON, Pokedex, fetch_pokemon, new_session
+from storage import InvalidQuery, PokemonQuery, TrainerStore
+from trainer_stats import TrainerStatsReader
+from tracing import span
+from writebehind import LevelUpBuffer
+
+store: TrainerStore = storage.get_backend()
+
+pokemon_cache = PokemonCache(
+    maxsize=int(os.environ.get("POKEAPI_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("POKEAPI_CACHE_TTL", 86400)),
+    negative_ttl=float(os.environ.get("POKEAPI_CACHE_NEGATIVE_TTL", 3600)),
+    path=os.environ.get("POKEAPI_CACHE_PATH")
+)
+
+pokeapi_session = new_session(IO_WORKERS)
+
+# Concurrent lookups of the same pokemon share a single PokeAPI request.
+pokeapi_timeout = float(os.environ.get("POKEAPI_TIMEOUT", 10))
+pokeapi_flights = SingleFlight(timeout=pokeapi_timeout)
+
+# Trainers and pages of their pokemon are cached per trainer, and dropped
+# whenever the trainer or their pokemon are written by this process.
+trainer_cache = GroupedCache(
+    maxsize=int(os.environ.get("TRAINER_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("TRAINER_CACHE_TTL", 60))
+)
+
+# Pokemon of a trainer are returned in pages of up to POKEMON_PAGE_SIZE by
+# default, and never more than POKEMON_MAX_PAGE_SIZE.
+pokemon_page_size = int(os.environ.get("POKEMON_PAGE_SIZE", 100))
+pokemon_max_page_size = int(os.environ.get("POKEMON_MAX_PAGE_SIZE", 1000))
+# Batch registrations hold at most POKEMON_BATCH_MAX_SIZE pokemon.
+pokemon_batch_max_size = int(os.environ.get("POKEMON_BATCH_MAX_SIZE", 500))
+
+# Level ups are written behind, coalesced per pokemon, every
+# LEVEL_UP_FLUSH_INTERVAL seconds, or once LEVEL_UP_FLUSH_SIZE pokemon are
+# buffered. They are written through when the interval is 0.
+level_up_flush_interval = float(os.environ.get("LEVEL_UP_FLUSH_INTERVAL", 0))
+level_up_flush_size = int(os.environ.get("LEVEL_UP_FLUSH_SIZE", 1000))
+level_up_buffer: Optional[LevelUpBuffer] = None
+
+# Statistics of each trainer, materialized from the Kafka topics into
+# TRAINER_STATS_PATH by prometheus/materializer.py.
+trainer_stats_path = os.environ.get("TRAINER_STATS_PATH")
+trainer_stats = TrainerStatsReader(trainer_stats_path) \
+    if trainer_stats_path else None
+leaderboard_max_size = int(os.environ.get("LEADERBOARD_MAX_SIZE", 100))
+
+pokedex_path = os.environ.get("POKEDEX_PATH")
+pokedex = Pokedex.load(pokedex_path) if pokedex_path else None
 
 
 def get_pokemon(number: int) -> models.Pokemon:
     """Retrieve info on the PokeAPI, given a pokemon ID number.
 
+    When a local snapshot is loaded through ``POKEDEX_PATH`` the pokemon is
+    served from memory. Otherwise, lookups are served from `pokemon_cache`
+    when possible, including IDs previously found not to exist, and
+    concurrent lookups of the same uncached ID share one PokeAPI request.
+
     Parameters
     ----------
     number : int
@@ -34,35 +79,54 @@ def get_pokemon(number: int) -> models.Pokemon:
     -------
     models.Pokemon
         Information about the pokemon retrived from the PokeAPI.
+
+    Raises
+    ------
+    ValueError
+        Pokemon not found on the PokeAPI.
+    TimeoutError
+        Timed out waiting for the PokeAPI.
     """
-    url = f"https://pokeapi.co/api/v2/pokemon/{number}"
-    response = requests.get(url).json()
-    pokemon = models.Pokemon(
-        id=response["id"],
-        name=response["name"],
-        artwork=response["sprites"]["other"]["official-artwork"]["front_default"]  # noqa: E501
-    )
+    if pokedex is not None:
+        pokemon = pokedex.get(number) or NOT_FOUND
+    else:
+        pokemon = pokemon_cache.get(number)
+        if pokemon is MISSING:
+            with span("pokeapi"):
+                pokemon = pokeapi_flights.do(number, _fetch_pokemon, number)
+    if pokemon is NOT_FOUND:
+        raise ValueError(f"Pokemon '{number}' not found.")
     return pokemon
 
 
-def get_trainer_document(trainer: str) -> DocumentSnapshot:
-    """Retrive document from Firestore with information about a trainer.
+def _fetch_pokemon(number: int):
+    # A flight for the same ID may have filled the cache, and finished, since
+    # the caller missed it. The caller already counted the lookup.
+    pokemon = pokemon_cache.get(number, count=False)
+    if pokemon is not MISSING:
+        return pokemon
+    pokemon = fetch_pokemon(number, pokeapi_session, pokeapi_timeout)
+    pokemon_cache.set(number, pokemon)
+    return pokemon
 
-    Parameters
-    ----------
-    trainer : str
-        Name of the trainer.
+
+def get_random_pokemon() -> models.Pokemon:
+    """Retrieve info about a random pokemon.
 
     Returns
     -------
-    google.cloud.firestore_v1.base_document.DocumentSnapshot
-        Snapshot of trainer document.
+    models.Pokemon
+        Information about the pokemon retrived from the PokeAPI.
     """
-    return db.collection("trainers").document(trainer)
+    if pokedex is not None:
+        return pokedex.random()
+    return get_pokemon(random.randint(1, LAST_POKEMON))
+
 
+def get_trainer(trainer: str) -> Cached:
+    """Retrieve information about a trainer from the storage backend.
 
-def get_trainer(trainer: str) -> models.Trainer:
-    """Retrieve information about a trainer from Firestore.
+    Trainers are served from `trainer_cache` when possible.
 
     Parameters
     ----------
@@ -71,24 +135,23 @@ def get_trainer(trainer: str) -> models.Trainer:
 
     Returns
     -------
-    models.Trainer
-        Trainer information.
+    cache.Cached
+        Trainer information, as a `models.Trainer`, and its ETag.
 
     Raises
     ------
     ValueError
-        Trainer not found on Firestore.
+        Trainer not found.
     """
-    doc = get_trainer_document(trainer)
-    if doc.get().exists:
-        trainer_data = models.Trainer.parse_obj(doc.get().to_dict())
-        return trainer_data
-    else:
-        raise ValueError(f"Trainer '{trainer}' not found.")
+    def load():
+        with span("storage"):
+            return store.get_trainer(trainer)
+
+    return trainer_cache.get(trainer, "trainer", load)
 
 
 def register_trainer(name: str, image: str) -> models.Trainer:
-    """Register a given trainer on Firestore.
+    """Register a given trainer on the storage backend.
 
     Parameters
     ----------
@@ -105,56 +168,83 @@ def register_trainer(name: str, image: str) -> models.Trainer:
     Raises
     ------
     ValueError
-        Trainer already registered on Firestore.
+        Trainer already registered.
     """
-    doc = get_trainer_document(name)
-    if not doc.get().exists:
-        data = {
-            "name": name,
-            "image": image,
-            "registered_at": datetime.now()
-        }
-        doc.set(data)
-        trainer_data = models.Trainer.parse_obj(data)
-        return trainer_data
-    else:
-        raise ValueError(f"Trainer '{name}' already registered.")
-
-
-def get_trainer_pokemon(trainer: str) -> models.TrainerPokemon:
-    """Retrieve a list of pokemon from the given trainer on Firestore.
+    try:
+        with span("storage"):
+            return store.register_trainer(name, image)
+    finally:
+        trainer_cache.invalidate(name)
+
+
+def get_trainer_pokemon(
+        trainer: str, limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+        fields: Optional[List[str]] = None, order_by: Optional[str] = None,
+        descending: bool = False, min_level: Optional[int] = None,
+        max_level: Optional[int] = None,
+        caught_after: Optional[datetime] = None,
+        caught_before: Optional[datetime] = None
+) -> Cached:
+    """Retrieve a page of pokemon from the given trainer.
+
+    Pages are served from `trainer_cache` when possible.
 
     Parameters
     ----------
     trainer : str
         Name of the trainer.
+    limit : int, optional
+        Maximum amount of pokemon to return. Defaults to
+        ``POKEMON_PAGE_SIZE``.
+    start_after : str, optional
+        ``next_cursor`` of the previous page.
+    fields : list of str, optional
+        Fields of each pokemon to return. Defaults to all of them.
+    order_by : str, optional
+        ``name``, ``level`` or ``caught_at``. Defaults to the filtered
+        field, or ``name``.
+    descending : bool
+        Whether to return the pokemon in descending order.
+    min_level, max_level : int, optional
+        Inclusive bounds of the level of the pokemon.
+    caught_after, caught_before : datetime, optional
+        Exclusive bounds of the time the pokemon were caught.
 
     Returns
     -------
-    models.TrainerPokemon
-        List of pokemon owned by the trainer.
+    cache.Cached
+        Page of pokemon owned by the trainer, as a
+        `models.TrainerPokemonPage` with the cursor of the next page, if any,
+        and its ETag.
 
     Raises
     ------
     ValueError
-        Trainer not found on Firestore.
+        Trainer not found.
+    storage.InvalidQuery
+        Invalid page parameters.
     """
-    trainer_doc = get_trainer_document(trainer)
-    if trainer_doc.get().exists:
-        collection = trainer_doc.collection("pokemon")
-        docs = [doc.to_dict() for doc in collection.get()]
-        data = {
-            "name": trainer,
-            "pokemon": docs
-        }
-        pokemon_data = models.TrainerPokemon.parse_obj(data)
-        return pokemon_data
-    else:
-        raise ValueError(f"Trainer '{trainer}' not found.")
+    limit = limit or pokemon_page_size
+    if limit > pokemon_max_page_size:
+        raise InvalidQuery(f"At most {pokemon_max_page_size} pokemon can be "
+                           f"returned per page.")
+    query = PokemonQuery(
+        limit, start_after=start_after, fields=fields, order_by=order_by,
+        descending=descending, min_level=min_level, max_level=max_level,
+        caught_after=caught_after, caught_before=caught_before)
+    key = ("pokemon", limit, start_after, tuple(fields or ()), order_by,
+           descending, min_level, max_level, caught_after, caught_before)
+
+    def load():
+        with span("storage"):
+            return store.get_trainer_pokemon_page(trainer, query)
+
+    return trainer_cache.get(trainer, key, load)
 
 
 def register_pokemon(trainer: str, pokemon: models.RegisterPokemon) -> models.RegisterPokemonResponse:  # noqa: E501
-    """Register a given pokemon to a given trainer on Firestore.
+    """Register a given pokemon to a given trainer.
 
     Parameters
     ----------
@@ -171,31 +261,162 @@ def register_pokemon(trainer: str, pokemon: models.RegisterPokemon) -> models.Re
     Raises
     ------
     ValueError
-        Trainer not found on Firestore.
+        Pokemon not found on the PokeAPI.
+    ValueError
+        Trainer not found.
     """
     info: models.Pokemon = get_pokemon(pokemon.id)
-    trainer_doc = get_trainer_document(trainer)
-    if not trainer_doc.get().exists:
-        raise ValueError(f"Trainer '{trainer}' not found.")
-    pokemon_doc = trainer_doc.collection("pokemon").document(info.name)
-    data = {
-        "id": info.id,
-        "name": info.name,
-        "nickname": pokemon.nickname,
-        "level": pokemon.level,
-        "caught_at": datetime.now(),
-        "artwork": info.artwork
+    if level_up_buffer is not None:
+        level_up_buffer.discard(trainer, [info.name])
+    try:
+        with span("storage"):
+            return store.register_pokemon(trainer, pokemon, info)
+    finally:
+        trainer_cache.invalidate(trainer)
+
+
+def register_pokemon_batch(
+        trainer: str, pokemon: List[models.RegisterPokemon],
+        infos: Dict[int, Union[models.Pokemon, Exception]]
+) -> models.RegisterPokemonBatchResponse:
+    """Register several pokemon to a given trainer at once.
+
+    Pokemon whose PokeAPI lookup failed are skipped, and reported in the
+    results along with the registered ones. So are pokemon of a species
+    already registered earlier in the batch, as conflicts.
+
+    Parameters
+    ----------
+    trainer : str
+        Name of the trainer.
+    pokemon : list of models.RegisterPokemon
+        Information about the pokemon to be registered.
+    infos : dict
+        Information about each pokemon ID retrieved from the PokeAPI, or the
+        exception raised while retrieving it.
+
+    Returns
+    -------
+    models.RegisterPokemonBatchResponse
+        Result of the registration of each pokemon, in the given order.
+
+    Raises
+    ------
+    ValueError
+        Trainer not found.
+    """
+    found, errors, first_index = [], {}, {}
+    for index, registration in enumerate(pokemon):
+        info = infos[registration.id]
+        if isinstance(info, Exception):
+            errors[index] = (404 if isinstance(info, ValueError) else 502,
+                             info)
+        elif info.name in first_index:
+            errors[index] = (409, ValueError(
+                f"Pokemon '{info.name}' is already registered at index "
+                f"{first_index[info.name]} of the batch."))
+        else:
+            first_index[info.name] = index
+            found.append((index, registration))
+    if level_up_buffer is not None:
+        level_up_buffer.discard(
+            trainer, [infos[registration.id].name for _, registration in found]
+        )
+    try:
+        with span("storage"):
+            registered = store.register_pokemon_batch(
+                trainer,
+                [(registration, infos[registration.id])
+                 for _, registration in found]
+            )
+    finally:
+        trainer_cache.invalidate(trainer)
+
+    results = {
+        index: models.RegisterPokemonResult(
+            index=index, id=registration.id, status_code=201,
+            pokemon=response)
+        for (index, registration), response in zip(found, registered)
     }
-    pokemon_doc.set(data)
-    data["trainer"] = trainer
-    pokemon_data = models.RegisterPokemonResponse.parse_obj(data)
-    return pokemon_data
+    for index, (status_code, error) in errors.items():
+        results[index] = models.RegisterPokemonResult(
+            index=index, id=pokemon[index].id, status_code=status_code,
+            error_type=type(error).__name__, error_message=str(error))
+    return models.RegisterPokemonBatchResponse(
+        trainer=trainer,
+        registered=len(found),
+        failed=len(pokemon) - len(found),
+        results=[results[index] for index in range(len(pokemon))]
+    )
+
+
+def get_trainer_stats(trainer: str) -> models.TrainerStats:
+    """Retrieve the statistics of a trainer.
+
+    Parameters
+    ----------
+    trainer : str
+        Name of the trainer.
+
+    Returns
+    -------
+    models.TrainerStats
+        Pokemon count, levels, most caught species and last activity of the
+        trainer.
+
+    Raises
+    ------
+    ValueError
+        Trainer stats not configured, or no stats for the trainer.
+    """
+    return _trainer_stats().get(trainer)
+
+
+def get_leaderboard(by: str = "pokemon_count",
+                    limit: int = 10) -> models.Leaderboard:
+    """Retrieve the statistics of the top trainers.
+
+    Parameters
+    ----------
+    by : str
+        Statistic the trainers are ranked by, in descending order.
+    limit : int
+        Amount of trainers to return.
+
+    Returns
+    -------
+    models.Leaderboard
+        Statistics of the top trainers.
+
+    Raises
+    ------
+    ValueError
+        Trainer stats not configured.
+    ValueError
+        Invalid order or limit.
+    """
+    if not 1 <= limit <= leaderboard_max_size:
+        raise ValueError(f"The leaderboard limit must be between 1 and "
+                         f"{leaderboard_max_size}.")
+    return _trainer_stats().leaderboard(by, limit)
+
+
+def _trainer_stats() -> TrainerStatsReader:
+    if trainer_stats is None:
+        raise ValueError("Trainer stats are not configured, set "
+                         "TRAINER_STATS_PATH.")
+    return trainer_stats
 
 
 def level_up_pokemon(trainer: str, pokemon: str,
                      levels: int) -> models.RegisterPokemonResponse:
     """Raise the level of a given pokemon by a given amount of levels.
 
+    When ``LEVEL_UP_FLUSH_INTERVAL`` is set, level ups of a pokemon that was
+    leveled up recently are buffered in `level_up_buffer`, and written later
+    as a single increment. The level the pokemon will have once they are
+    written is returned right away.
+
     Parameters
     ----------
     trainer : str
@@ -213,21 +434,30 @@ def level_up_pokemon(trainer: str, pokemon: str,
     Raises
     ------
     ValueError
-        Trainer not found on Firestore.
+        Trainer not found.
     ValueError
-        Pokemon not found on Firestore under the given trainer.
+        Pokemon not registered under the given trainer.
     """
-    trainer_doc = get_trainer_document(trainer)
-    if not trainer_doc.get().exists:
-        raise ValueError(f"Trainer '{trainer}' not found.")
-    pokemon_doc = trainer_doc.collection("pokemon").document(pokemon)
-    if not pokemon_doc.get().exists:
-        raise ValueError(
-            f"Pokemon '{pokemon}' not registered for trainer '{trainer}'.",
-        )
-    data = pokemon_doc.get().to_dict()
-    data["level"] = data["level"] + levels
-    pokemon_doc.set(data)
-    data["trainer"] = trainer
-    pokemon_data = models.RegisterPokemonResponse.parse_obj(data)
-    return pokemon_data
+    if level_up_buffer is not None:
+        return level_up_buffer.level_up(trainer, pokemon, levels)
+    return _write_level_up(trainer, pokemon, levels)
+
+
+def _write_level_up(trainer: str, pokemon: str,
+                    levels: int) -> models.RegisterPokemonResponse:
+    try:
+        with span("storage"):
+            return store.level_up_pokemon(trainer, pokemon, levels)
+    finally:
+        trainer_cache.invalidate(trainer)
+
+
+if level_up_flush_interval > 0:
+    level_up_buffer = LevelUpBuffer(
+        _write_level_up, level_up_flush_interval, level_up_flush_size)
+
+
+def shutdown():
+    """Write the level ups still buffered to storage."""
+    if level_up_buffer is not None:
+        level_up_buffer.close()
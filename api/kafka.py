@@ -1,12 +1,21 @@
+import asyncio
 import json
 import logging
 import os
+import threading
 import time
 from datetime import datetime
 from functools import wraps
 
+import msgpack
 from confluent_kafka import Producer
-from fastapi.encoders import jsonable_encoder
+
+import tracing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 formatter = logging.Formatter(
@@ -17,54 +26,207 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 _producer = None
+_poll_thread = None
+_stopping = threading.Event()
+
+# When the local queue of the producer is full, messages are either dropped
+# right away ("drop") or after waiting up to KAFKA_QUEUE_BLOCK_MS for room
+# ("block"), which applies backpressure to the request. The wait yields to
+# the event loop, so other requests keep being served meanwhile.
+_queue_full_policy = os.environ.get("KAFKA_QUEUE_FULL_POLICY", "drop")
+_queue_block_timeout = int(os.environ.get("KAFKA_QUEUE_BLOCK_MS", 50)) / 1000
+
+# Messages are published as JSON or, with KAFKA_EVENT_FORMAT=msgpack, as a
+# schema header followed by a MessagePack array of the fields in
+# EVENT_FIELDS. KAFKA_EVENT_RESPONSE=projection keeps only the response
+# fields listed in PROJECTIONS for the topic, instead of the full body.
+# Events also carry the seconds spent in each phase of the request, as
+# traced by the tracing module, in the "phases" field.
+_event_format = os.environ.get("KAFKA_EVENT_FORMAT", "json")
+_event_response = os.environ.get("KAFKA_EVENT_RESPONSE", "full")
+
+EVENT_SCHEMA_VERSION = 2
+EVENT_HEADER = b"MPA" + bytes([EVENT_SCHEMA_VERSION])
+EVENT_FIELDS = ("endpoint", "request_type", "response_status", "start_time",
+                "elapsed_time", "response", "phases")
+
+PROJECTIONS = {
+    "POKEMON__RANDOM": ("id", "name"),
+    "POKEMON__ID": ("id", "name"),
+    "TRAINERS__NAME": ("name",),
+    "TRAINERS__REGISTER": ("name",),
+    "TRAINERS__NAME__POKEMON": ("name",),
+    "TRAINERS__NAME__POKEMON__REGISTER": ("trainer", "id", "name", "level"),
+    "TRAINERS__NAME__POKEMON__BATCH__REGISTER": (
+        "trainer", "registered", "failed", "results"),
+    "TRAINERS__NAME__POKEMON__NAME__LEVEL__REGISTER": (
+        "trainer", "id", "name", "level"),
+    "TRAINERS__NAME__STATS": ("trainer",),
+    "LEADERBOARD": ("by",),
+}
+
+stats = {"produced": 0, "delivered": 0, "failed": 0, "dropped": 0}
 
 
 def _setup_producer():
-    global _producer
+    global _producer, _poll_thread
     if _producer is None:
         endpoint = os.environ.get("KAFKA_ENDPOINT", "localhost:19092")
-        conf = {"bootstrap.servers": endpoint}
+        conf = {
+            "bootstrap.servers": endpoint,
+            "linger.ms": int(os.environ.get("KAFKA_LINGER_MS", 20)),
+            "batch.num.messages": int(
+                os.environ.get("KAFKA_BATCH_NUM_MESSAGES", 1000)),
+            "compression.type": os.environ.get("KAFKA_COMPRESSION", "lz4"),
+            "queue.buffering.max.messages": int(
+                os.environ.get("KAFKA_QUEUE_SIZE", 10000))
+        }
         _producer = Producer(conf)
+        _poll_thread = threading.Thread(
+            target=_poll_loop, name="kafka-poll", daemon=True)
+        _poll_thread.start()
+
+
+def _poll_loop():
+    # Serves delivery callbacks off the request path.
+    while not _stopping.is_set():
+        _producer.poll(0.1)
 
 
 def _callback(err, msg):
     if err is not None:
+        stats["failed"] += 1
         logger.error(f"Message delivery failed: {err}")
     else:
-        logger.info(
-            f"Message '{msg.value().decode('utf-8')}' delivered to topic "
-            f"{msg.topic()}."
-        )
+        stats["delivered"] += 1
+        logger.debug(f"Message delivered to topic {msg.topic()}.")
 
 
-def _push_message(message: dict, topic: str):
+async def _produce(topic: str, value: bytes):
+    try:
+        _producer.produce(topic, value=value, callback=_callback)
+        return
+    except BufferError:
+        if _queue_full_policy != "block":
+            raise
+    deadline = time.monotonic() + _queue_block_timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.001)
+        try:
+            _producer.produce(topic, value=value, callback=_callback)
+            return
+        except BufferError:
+            continue
+    raise BufferError("Kafka producer queue is still full.")
+
+
+def _dumps(data: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def _encode_message(message: dict, body: bytes) -> bytes:
+    """Serialize `message` with the already rendered response `body`.
+
+    The response is spliced into the envelope as is, instead of being
+    parsed back and serialized again.
+    """
+    envelope = _dumps(message)
+    return envelope[:-1] + b',"response":' + body + b"}"
+
+
+def _response_content(topic: str, response):
+    fields = PROJECTIONS.get(topic)
+    projected = _event_response == "projection" and fields is not None
+    # Responses of the responses module project the content they were
+    # rendered from, others are decoded from the body.
+    if projected and hasattr(response, "project"):
+        return response.project(fields + ("error_type",))
+    content = getattr(response, "content", None)
+    if content is None and response.body:
+        content = json.loads(response.body)
+    if not projected or not isinstance(content, dict):
+        return content
+    return {
+        field: content[field]
+        for field in fields + ("error_type",) if field in content
+    }
+
+
+def _build_message(topic: str, request_type: str, response,
+                   start_time: float, elapsed_time: float,
+                   phases: dict = None) -> bytes:
+    phases = dict(phases or {})
+    endpoint = "/" + topic.lower().replace("__", "/")
+    # The "event_content" phase is the time spent preparing the response
+    # for the event. Encoding and producing the message happen after the
+    # phases are written, so they are not part of it.
+    content_start = time.perf_counter()
+    content = None
+    if _event_format == "msgpack" or _event_response == "projection":
+        content = _response_content(topic, response)
+    phases["event_content"] = time.perf_counter() - content_start
+    if _event_format == "msgpack":
+        fields = [endpoint, request_type, response.status_code, start_time,
+                  elapsed_time, content, phases]
+        return EVENT_HEADER + msgpack.packb(fields)
+    message = {
+        "endpoint": endpoint,
+        "request_type": request_type,
+        "response_status": response.status_code,
+        "start_time": datetime.fromtimestamp(start_time).isoformat(),
+        "elapsed_time": elapsed_time,
+        "phases": phases
+    }
+    if _event_response != "projection":
+        # Responses without a body, like 304, are published as null.
+        return _encode_message(message, response.body or b"null")
+    message["response"] = content
+    return _dumps(message)
+
+
+async def _push_message(message: bytes, topic: str):
     try:
         _setup_producer()
-        message = json.dumps(message)
-        _producer.produce(topic, value=message, callback=_callback)
-        _producer.poll(1)
+        await _produce(topic, message)
+        stats["produced"] += 1
+    except BufferError:
+        stats["dropped"] += 1
+        logger.warning(f"Kafka producer queue is full, dropped message to "
+                       f"topic {topic}.")
     except Exception as e:
         logger.error(f'Failed to push message "{message}" to Kafka. '
                      f'Error - {str(e)}')
 
 
+def shutdown(timeout: float = 10):
+    """Stop the delivery thread and flush pending messages to Kafka."""
+    _stopping.set()
+    if _producer is not None:
+        _poll_thread.join()
+        remaining = _producer.flush(timeout)
+        if remaining:
+            logger.error(f"{remaining} messages not delivered to Kafka "
+                         f"before shutdown.")
+
+
 def kafka_logging(topic: str, request_type: str = "GET"):
 
     def decorator(method):
         @wraps(method)
         async def wrapper(*args, **kwargs):
+            token = tracing.start()
             start_time = time.time()
-            response = await method(*args, **kwargs)
+            try:
+                response = await method(*args, **kwargs)
+            finally:
+                phases = tracing.finish(token)
             elapsed_time = time.time() - start_time
-            message = {
-                "endpoint": "/" + topic.lower().replace("__", "/"),
-                "request_type": request_type,
-                "response_status": response.status_code,
-                "response": json.loads(response.body.decode('utf-8')),
-                "start_time": datetime.fromtimestamp(start_time),
-                "elapsed_time": elapsed_time
-            }
-            _push_message(jsonable_encoder(message), topic)
+            message = _build_message(
+                topic, request_type, response, start_time, elapsed_time,
+                phases)
+            await _push_message(message, topic)
             return response
 
         return wrapper
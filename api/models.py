@@ -1,8 +1,16 @@
+import os
 from datetime import datetime
-from typing import List
+from typing import List, Optional, Type, TypeVar
 
 from pydantic import BaseModel
 
+# Data read back from storage was validated when it was written, so with
+# FAST_SERIALIZATION set it is loaded into models without validating it
+# again, and responses are encoded straight from the models.
+FAST_SERIALIZATION = os.environ.get("FAST_SERIALIZATION", "0") == "1"
+
+Model = TypeVar("Model", bound=BaseModel)
+
 
 class Pokemon(BaseModel):
     id: int
@@ -30,6 +38,21 @@ class TrainerPokemon(BaseModel):
     pokemon: List[CaughtPokemon]
 
 
+class PartialCaughtPokemon(BaseModel):
+    id: Optional[int]
+    name: Optional[str]
+    nickname: Optional[str]
+    level: Optional[int]
+    caught_at: Optional[datetime]
+    artwork: Optional[str]
+
+
+class TrainerPokemonPage(BaseModel):
+    name: str
+    pokemon: List[PartialCaughtPokemon]
+    next_cursor: Optional[str] = None
+
+
 class RegisterPokemon(BaseModel):
     id: int
     nickname: str
@@ -40,5 +63,49 @@ class RegisterPokemonResponse(CaughtPokemon):
     trainer: str
 
 
+class RegisterPokemonResult(BaseModel):
+    index: int
+    id: int
+    status_code: int
+    pokemon: Optional[RegisterPokemonResponse] = None
+    error_type: Optional[str] = None
+    error_message: Optional[str] = None
+
+
+class RegisterPokemonBatchResponse(BaseModel):
+    trainer: str
+    registered: int
+    failed: int
+    results: List[RegisterPokemonResult]
+
+
 class Level(BaseModel):
     levels: int = 1
+
+
+class TrainerStats(BaseModel):
+    trainer: str
+    pokemon_count: int
+    caught: int
+    average_level: Optional[float]
+    max_level: Optional[int]
+    most_caught_species: Optional[str]
+    most_caught_species_count: int
+    last_activity: Optional[datetime]
+
+
+class Leaderboard(BaseModel):
+    by: str
+    trainers: List[TrainerStats]
+
+
+def load(model: Type[Model], data: dict) -> Model:
+    """Load `data` read back from storage into `model`.
+
+    With ``FAST_SERIALIZATION`` set, the model is built without validation,
+    so nested models must be loaded by the caller, and values are kept as
+    stored, e.g. datetimes as ISO strings on the ``sqlite`` backend.
+    """
+    if FAST_SERIALIZATION:
+        return model.construct(**data)
+    return model.parse_obj(data)
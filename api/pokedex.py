@@ -0,0 +1,141 @@
+"""Local snapshot of the PokeAPI data used by the MPA API.
+
+Running this module downloads every pokemon once into a compact JSON file,
+which the API serves entirely from memory when ``POKEDEX_PATH`` points to it::
+
+    python pokedex.py --output pokedex.json
+"""
+import argparse
+import json
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+import models
+from cache import NOT_FOUND
+
+POKEAPI_URL = os.environ.get(
+    "POKEAPI_URL", "https://pokeapi.co/api/v2/pokemon")
+LAST_POKEMON = 905
+
+
+def new_session(pool_size: int) -> requests.Session:
+    """Create a session pooling up to `pool_size` PokeAPI connections."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_pokemon(number: int, session: Optional[requests.Session] = None,
+                  timeout: Optional[float] = None):
+    """Download info about a pokemon from the PokeAPI.
+
+    Parameters
+    ----------
+    number : int
+        ID of a pokemon.
+    session : requests.Session, optional
+        Session used to reuse connections between calls.
+    timeout : float, optional
+        Seconds to wait for the PokeAPI. Waits indefinitely if not given.
+
+    Returns
+    -------
+    models.Pokemon
+        Information about the pokemon, or ``cache.NOT_FOUND`` if the PokeAPI
+        does not know the given ID.
+    """
+    response = (session or requests).get(
+        f"{POKEAPI_URL}/{number}", timeout=timeout)
+    if response.status_code == 404:
+        return NOT_FOUND
+    response.raise_for_status()
+    response = response.json()
+    pokemon = models.Pokemon(
+        id=response["id"],
+        name=response["name"],
+        artwork=response["sprites"]["other"]["official-artwork"]["front_default"]  # noqa: E501
+    )
+    return pokemon
+
+
+class Pokedex:
+    """In-memory index of pokemon, by ID and by name.
+
+    Parameters
+    ----------
+    pokemon : list of models.Pokemon
+        Pokemon to index.
+    """
+
+    def __init__(self, pokemon: List[models.Pokemon]):
+        self._by_id: Dict[int, models.Pokemon] = {p.id: p for p in pokemon}
+        self._by_name: Dict[str, int] = {p.name: p.id for p in pokemon}
+        self._ids: List[int] = sorted(self._by_id)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get(self, number: int) -> Optional[models.Pokemon]:
+        return self._by_id.get(number)
+
+    def get_by_name(self, name: str) -> Optional[models.Pokemon]:
+        number = self._by_name.get(name.lower())
+        return None if number is None else self._by_id[number]
+
+    def random(self) -> models.Pokemon:
+        return self._by_id[random.choice(self._ids)]
+
+    @classmethod
+    def load(cls, path: str) -> "Pokedex":
+        """Load a snapshot written by `Pokedex.dump`."""
+        with open(path) as f:
+            rows = json.load(f)["pokemon"]
+        pokemon = [
+            models.Pokemon(id=id_, name=name, artwork=artwork)
+            for id_, name, artwork in rows
+        ]
+        return cls(pokemon)
+
+    def dump(self, path: str):
+        """Write the snapshot as compact ``[id, name, artwork]`` rows."""
+        rows = [
+            [p.id, p.name, p.artwork]
+            for p in (self._by_id[id_] for id_ in self._ids)
+        ]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"pokemon": rows}, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+
+def download(last: int = LAST_POKEMON, workers: int = 16) -> Pokedex:
+    """Download every pokemon from 1 to `last` from the PokeAPI."""
+    session = new_session(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda number: fetch_pokemon(number, session),
+            range(1, last + 1)
+        )
+        pokemon = [p for p in results if p is not NOT_FOUND]
+    return Pokedex(pokemon)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download a local snapshot of the PokeAPI.")
+    parser.add_argument("--output", default="pokedex.json")
+    parser.add_argument("--last", type=int, default=LAST_POKEMON,
+                        help="ID of the last pokemon to download.")
+    parser.add_argument("--workers", type=int, default=16,
+                        help="Amount of concurrent downloads.")
+    args = parser.parse_args()
+
+    pokedex = download(args.last, args.workers)
+    pokedex.dump(args.output)
+    print(f"Saved {len(pokedex)} pokemon to '{args.output}'.")
@@ -0,0 +1,131 @@
+import json
+from datetime import datetime
+from typing import Any, Optional, Sequence
+
+from fastapi import responses
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+import models
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONResponse(responses.JSONResponse):
+    """JSON response that keeps the content it was rendered from.
+
+    `kafka.kafka_logging` reads `content` to publish the response, or a
+    projection of it, without parsing the rendered body back.
+    """
+
+    def render(self, content: Any) -> bytes:
+        self.content = content
+        return super().render(content)
+
+    def project(self, fields: Sequence[str]) -> Any:
+        """The given top-level fields of the content, when it is a dict."""
+        content = self.content
+        if not isinstance(content, dict):
+            return content
+        return {field: content[field] for field in fields if field in content}
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded straight from models with orjson.
+
+    Models are not converted into dicts with `jsonable_encoder` first, which
+    walks and copies every nested value before the standard library encodes
+    them again. The model is kept, and only converted into `content` when
+    it is read, so `kafka.kafka_logging` projects it without converting the
+    fields it leaves out, nor decoding the rendered body.
+
+    Parameters
+    ----------
+    exclude_unset : bool
+        Whether to leave out the fields of the models that were not set.
+    """
+
+    def __init__(self, content: Any, *args, exclude_unset: bool = False,
+                 **kwargs):
+        self.exclude_unset = exclude_unset
+        super().__init__(content, *args, **kwargs)
+
+    @property
+    def content(self) -> Any:
+        if self._content is None and self._model is not None:
+            self._content = jsonable_encoder(
+                self._model, exclude_unset=self.exclude_unset)
+        return self._content
+
+    def project(self, fields: Sequence[str]) -> Any:
+        model = self._model
+        if not isinstance(model, BaseModel):
+            return super().project(fields)
+        return {
+            field: jsonable_encoder(getattr(model, field),
+                                    exclude_unset=self.exclude_unset)
+            for field in fields
+            if field in model.__fields__ and
+            (not self.exclude_unset or field in model.__fields_set__)
+        }
+
+    def render(self, content: Any) -> bytes:
+        self._model, self._content = content, None
+        if orjson is None:
+            data = jsonable_encoder(content, exclude_unset=self.exclude_unset)
+            return json.dumps(data, separators=(",", ":")).encode("utf-8")
+        default = _unset_fields if self.exclude_unset else _fields
+        return orjson.dumps(content, default=default)
+
+
+def _fields(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.__dict__
+    # Subclasses of datetime, like Firestore timestamps, are not encoded by
+    # orjson itself.
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError
+
+
+def _unset_fields(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return {
+            field: field_value
+            for field, field_value in value.__dict__.items()
+            if field in value.__fields_set__
+        }
+    return _fields(value)
+
+
+def model_response(model: BaseModel, status_code: int = 200,
+                   headers: Optional[dict] = None,
+                   exclude_unset: bool = False) -> JSONResponse:
+    """Respond with `model`, encoded with `ORJSONResponse` when
+    ``FAST_SERIALIZATION`` is set."""
+    if models.FAST_SERIALIZATION:
+        return ORJSONResponse(model, status_code, headers,
+                              exclude_unset=exclude_unset)
+    json_data = jsonable_encoder(model, exclude_unset=exclude_unset)
+    return JSONResponse(json_data, status_code, headers)
+
+
+class NotModifiedResponse(responses.Response):
+    """Empty ``304 Not Modified`` response to a conditional request."""
+
+    content = None
+
+    def __init__(self, etag: str):
+        super().__init__(status_code=304, headers={"ETag": etag})
+
+
+def not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an ``If-None-Match`` header matches the given ETag."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as GET requests allow.
+    return "*" in tags or etag in (tag.removeprefix("W/") for tag in tags)
@@ -1,23 +1,37 @@
-import random
+import asyncio
+from datetime import datetime
+from typing import List
+
 import uvicorn
-from fastapi import FastAPI
-from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Header
 
+import concurrency
 import database as db
+import kafka
 import models
+from concurrency import run_io
 from kafka import kafka_logging
+from responses import (
+    JSONResponse, NotModifiedResponse, model_response, not_modified
+)
+from storage import InvalidQuery
 
 app = FastAPI()
 
 
+@app.on_event("shutdown")
+def shutdown():
+    concurrency.shutdown()
+    db.shutdown()
+    kafka.shutdown()
+
+
 @app.get("/pokemon/random", response_model=models.Pokemon)
 @kafka_logging("POKEMON__RANDOM")
 async def get_random_pokemon() -> JSONResponse:
     """Retrieve info for a random pokemon."""
-    number = random.randrange(1, 906)
-    pokemon: models.Pokemon = db.get_pokemon(number)
-    return JSONResponse(pokemon.dict())
+    pokemon: models.Pokemon = await run_io(db.get_random_pokemon)
+    return model_response(pokemon)
 
 
 @app.get("/pokemon/{number}", response_model=models.Pokemon)
@@ -36,21 +50,25 @@ async def get_pokemon_from_number(number: int) -> JSONResponse:
         Information about the fetched pokemon.
     """
     try:
-        pokemon: models.Pokemon = db.get_pokemon(number)
-        return JSONResponse(pokemon.dict())
+        pokemon: models.Pokemon = await run_io(db.get_pokemon, number)
+        return model_response(pokemon)
     except Exception as e:
         return _handle_error(e)
 
 
 @app.get("/trainers/{trainer}", response_model=models.Trainer)
 @kafka_logging("TRAINERS__NAME")
-async def get_trainer(trainer: str) -> JSONResponse:
+async def get_trainer(trainer: str,
+                      if_none_match: str = Header(None)) -> JSONResponse:
     """Retrieve info on Firestore for a given trainer.
 
     Parameters
     ----------
     trainer : str
         Name of the trainer.
+    if_none_match : str, optional
+        ETag of a previous response, answered with ``304 Not Modified`` if
+        the trainer did not change since.
 
     Returns
     -------
@@ -58,9 +76,10 @@ async def get_trainer(trainer: str) -> JSONResponse:
         Information about the fetched trainer.
     """
     try:
-        trainer_data: models.Trainer = db.get_trainer(trainer)
-        json_data: dict = jsonable_encoder(trainer_data)
-        return JSONResponse(json_data)
+        etag, trainer_data = await run_io(db.get_trainer, trainer)
+        if not_modified(if_none_match, etag):
+            return NotModifiedResponse(etag)
+        return model_response(trainer_data, headers={"ETag": etag})
     except Exception as e:
         return _handle_error(e)
 
@@ -81,32 +100,67 @@ async def register_trainer(trainer: models.Trainer) -> JSONResponse:
         Information about the registered trainer.
     """
     try:
-        trainer_data = db.register_trainer(trainer.name, trainer.image)
-        json_data: dict = jsonable_encoder(trainer_data)
-        return JSONResponse(json_data, 201)
+        trainer_data = await run_io(
+            db.register_trainer, trainer.name, trainer.image)
+        return model_response(trainer_data, 201)
     except Exception as e:
         return _handle_error(e)
 
 
-@app.get("/trainers/{trainer}/pokemon", response_model=models.TrainerPokemon)
+@app.get("/trainers/{trainer}/pokemon",
+         response_model=models.TrainerPokemonPage,
+         response_model_exclude_unset=True)
 @kafka_logging("TRAINERS__NAME__POKEMON")
-async def get_trainer_pokemon(trainer: str) -> JSONResponse:
-    """Retrieve a list of pokemon for a given trainer.
+async def get_trainer_pokemon(trainer: str, limit: int = None,
+                              start_after: str = None, fields: str = None,
+                              order_by: str = None, descending: bool = False,
+                              min_level: int = None, max_level: int = None,
+                              caught_after: datetime = None,
+                              caught_before: datetime = None,
+                              if_none_match: str = Header(None)
+                              ) -> JSONResponse:
+    """Retrieve a page of pokemon for a given trainer.
 
     Parameters
     ----------
     trainer : str
         Name of the trainer.
+    limit : int, optional
+        Maximum amount of pokemon to return.
+    start_after : str, optional
+        ``next_cursor`` of the previous page.
+    fields : str, optional
+        Comma separated fields of each pokemon to return, e.g.
+        ``id,name,level``. Defaults to all of them.
+    order_by : str, optional
+        ``name``, ``level`` or ``caught_at``. Defaults to the filtered
+        field, or ``name``.
+    descending : bool
+        Whether to return the pokemon in descending order.
+    min_level, max_level : int, optional
+        Inclusive bounds of the level of the pokemon.
+    caught_after, caught_before : datetime, optional
+        Exclusive bounds of the time the pokemon were caught.
+    if_none_match : str, optional
+        ETag of a previous response, answered with ``304 Not Modified`` if
+        the page did not change since.
 
     Returns
     -------
     JSONResponse
-        List of registered pokemon for the given trainer.
+        Page of registered pokemon for the given trainer.
     """
     try:
-        pokemon_data: models.TrainerPokemon = db.get_trainer_pokemon(trainer)
-        json_data: dict = jsonable_encoder(pokemon_data)
-        return JSONResponse(json_data, 200)
+        etag, pokemon_data = await run_io(
+            db.get_trainer_pokemon, trainer, limit, start_after,
+            fields.split(",") if fields else None, order_by, descending,
+            min_level, max_level, caught_after, caught_before)
+        if not_modified(if_none_match, etag):
+            return NotModifiedResponse(etag)
+        return model_response(pokemon_data, headers={"ETag": etag},
+                              exclude_unset=True)
+    except InvalidQuery as e:
+        return _handle_error(e, 422)
     except Exception as e:
         return _handle_error(e)
 
@@ -130,10 +184,53 @@ async def register_pokemon(trainer: str,
         Information about the registered pokemon.
     """
     try:
-        pokemon_data: models.CaughtPokemon = db.register_pokemon(
-            trainer, pokemon)
-        json_data: dict = jsonable_encoder(pokemon_data)
-        return JSONResponse(json_data, 201)
+        pokemon_data: models.CaughtPokemon = await run_io(
+            db.register_pokemon, trainer, pokemon)
+        return model_response(pokemon_data, 201)
+    except Exception as e:
+        return _handle_error(e)
+
+
+@app.post("/trainers/{trainer}/pokemon/batch",
+          response_model=models.RegisterPokemonBatchResponse)
+@kafka_logging("TRAINERS__NAME__POKEMON__BATCH__REGISTER", "POST")
+async def register_pokemon_batch(
+        trainer: str, pokemon: List[models.RegisterPokemon]) -> JSONResponse:
+    """Register several pokemon for a given trainer at once.
+
+    The PokeAPI info of each pokemon is retrieved concurrently, and the
+    pokemon found are written together. Pokemon that could not be found, or
+    whose species appears earlier in the batch, are reported in the results
+    instead of failing the whole request. Batches of more than
+    ``POKEMON_BATCH_MAX_SIZE`` pokemon are rejected with a 422.
+
+    Parameters
+    ----------
+    trainer : str
+        Name of the trainer.
+    pokemon : list of models.RegisterPokemon
+        Information about the pokemon to register.
+
+    Returns
+    -------
+    JSONResponse
+        Result of the registration of each pokemon.
+    """
+    if len(pokemon) > db.pokemon_batch_max_size:
+        return _handle_error(ValueError(
+            f"At most {db.pokemon_batch_max_size} pokemon can be registered "
+            f"per batch."), 422)
+    try:
+        # Unknown trainers are rejected before looking up any pokemon.
+        await run_io(db.get_trainer, trainer)
+        numbers = list(dict.fromkeys(p.id for p in pokemon))
+        infos = await asyncio.gather(
+            *(run_io(db.get_pokemon, number) for number in numbers),
+            return_exceptions=True)
+        batch_data: models.RegisterPokemonBatchResponse = await run_io(
+            db.register_pokemon_batch, trainer, pokemon,
+            dict(zip(numbers, infos)))
+        return model_response(batch_data, 201)
     except Exception as e:
         return _handle_error(e)
 
@@ -162,20 +259,85 @@ async def level_up_pokemon(trainer: str, pokemon: str,
         Information about the pokemon.
     """
     try:
-        pokemon_data: models.RegisterPokemonResponse = db.level_up_pokemon(
-            trainer, pokemon, levels.levels)
-        json_data: dict = jsonable_encoder(pokemon_data)
-        return JSONResponse(json_data, 201)
+        pokemon_data: models.RegisterPokemonResponse = await run_io(
+            db.level_up_pokemon, trainer, pokemon, levels.levels)
+        return model_response(pokemon_data, 201)
+    except Exception as e:
+        return _handle_error(e)
+
+
+@app.get("/trainers/{trainer}/stats", response_model=models.TrainerStats)
+@kafka_logging("TRAINERS__NAME__STATS")
+async def get_trainer_stats(trainer: str) -> JSONResponse:
+    """Retrieve statistics of a trainer, materialized from the Kafka topics.
+
+    Parameters
+    ----------
+    trainer : str
+        Name of the trainer.
+
+    Returns
+    -------
+    JSONResponse
+        Pokemon count, levels, most caught species and last activity of the
+        trainer.
+    """
+    try:
+        stats: models.TrainerStats = await run_io(
+            db.get_trainer_stats, trainer)
+        return model_response(stats)
+    except Exception as e:
+        return _handle_error(e)
+
+
+@app.get("/leaderboard", response_model=models.Leaderboard)
+@kafka_logging("LEADERBOARD")
+async def get_leaderboard(by: str = "pokemon_count",
+                          limit: int = 10) -> JSONResponse:
+    """Retrieve the top trainers by one of their statistics.
+
+    Parameters
+    ----------
+    by : str
+        ``pokemon_count``, ``caught``, ``average_level``, ``max_level`` or
+        ``last_activity``.
+    limit : int
+        Amount of trainers to return.
+
+    Returns
+    -------
+    JSONResponse
+        Statistics of the top trainers, in descending order.
+    """
+    try:
+        leaderboard: models.Leaderboard = await run_io(
+            db.get_leaderboard, by, limit)
+        return model_response(leaderboard)
     except Exception as e:
         return _handle_error(e)
 
 
-def _handle_error(error: Exception) -> JSONResponse:
+@app.get("/stats")
+async def get_stats() -> JSONResponse:
+    """Retrieve counters of the API caches, storage and Kafka producer."""
+    stats = {
+        "pokeapi_cache": db.pokemon_cache.stats(),
+        "pokeapi_flights": db.pokeapi_flights.stats(),
+        "trainer_cache": db.trainer_cache.stats(),
+        "storage_round_trips": db.store.round_trips.snapshot(),
+        "kafka": kafka.stats
+    }
+    if db.level_up_buffer is not None:
+        stats["level_up_buffer"] = db.level_up_buffer.stats()
+    return JSONResponse(stats)
+
+
+def _handle_error(error: Exception, status_code: int = 404) -> JSONResponse:
     error_response = {
         "error_type": type(error).__name__,
         "error_message": str(error)
     }
-    return JSONResponse(error_response, 404)
+    return JSONResponse(error_response, status_code)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,41 @@
+import os
+
+from storage.base import InvalidQuery, PokemonQuery, RoundTrips, TrainerStore
+
+__all__ = ["InvalidQuery", "PokemonQuery", "RoundTrips", "TrainerStore",
+           "get_backend"]
+
+
+def get_backend(name: str = None) -> TrainerStore:
+    """Create the trainer store selected by name.
+
+    Parameters
+    ----------
+    name : str, optional
+        One of ``firestore``, ``memory`` or ``sqlite``. Defaults to the
+        ``STORAGE_BACKEND`` environment variable, or ``firestore``.
+
+    Returns
+    -------
+    storage.TrainerStore
+        The selected backend.
+
+    Raises
+    ------
+    ValueError
+        Unknown backend name.
+    """
+    name = name or os.environ.get("STORAGE_BACKEND", "firestore")
+    if name == "firestore":
+        from storage.firestore import FirestoreStore
+        return FirestoreStore(
+            project_id=os.environ.get("FIRESTORE_PROJECT", "hotaru-gcp"),
+            credentials_path="serviceAccountKey.json"
+        )
+    if name == "memory":
+        from storage.memory import MemoryStore
+        return MemoryStore()
+    if name == "sqlite":
+        from storage.sqlite import SQLiteStore
+        return SQLiteStore(os.environ.get("SQLITE_PATH", "mpa.db"))
+    raise ValueError(f"Unknown storage backend '{name}'.")
@@ -0,0 +1,285 @@
+import base64
+import binascii
+import json
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+import models
+
+# Fields the pokemon of a trainer can be ordered by. Pokemon with the same
+# value are ordered by name, which is unique per trainer.
+ORDER_FIELDS = ("name", "level", "caught_at")
+POKEMON_FIELDS = tuple(models.CaughtPokemon.__fields__)
+
+
+class InvalidQuery(ValueError):
+    """Invalid parameters of a `PokemonQuery`, as opposed to a missing
+    trainer."""
+
+
+class RoundTrips:
+    """Thread-safe count of storage round-trips, by kind of operation.
+
+    Kinds are ``read`` for document gets, ``query`` for collection queries
+    and ``write`` for document writes.
+    """
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, kind: str):
+        with self._lock:
+            self._counts[kind] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+class PokemonQuery:
+    """A page of the pokemon of a trainer, in a given order.
+
+    Pages start after the cursor returned with the previous page, so every
+    page costs the same no matter how deep into the collection it is. Like
+    on Firestore, range filters only apply to the field the pokemon are
+    ordered by.
+
+    Parameters
+    ----------
+    limit : int
+        Maximum amount of pokemon in the page.
+    start_after : str, optional
+        ``next_cursor`` of the previous page.
+    fields : iterable of str, optional
+        Fields of each pokemon to return. Defaults to all of them.
+    order_by : str, optional
+        One of ``ORDER_FIELDS``. Defaults to the filtered field, or
+        ``name``.
+    descending : bool
+        Whether to return the pokemon in descending order.
+    min_level, max_level : int, optional
+        Inclusive bounds of the level of the pokemon.
+    caught_after, caught_before : datetime, optional
+        Exclusive bounds of the time the pokemon were caught. Bounds with a
+        timezone are converted to the naive local time the pokemon are
+        stored with.
+
+    Raises
+    ------
+    InvalidQuery
+        Invalid field, range filter or cursor.
+    """
+
+    def __init__(self, limit: int, start_after: Optional[str] = None,
+                 fields: Optional[Iterable[str]] = None,
+                 order_by: Optional[str] = None, descending: bool = False,
+                 min_level: Optional[int] = None,
+                 max_level: Optional[int] = None,
+                 caught_after: Optional[datetime] = None,
+                 caught_before: Optional[datetime] = None):
+        if limit < 1:
+            raise InvalidQuery("The page limit must be at least 1.")
+        self.limit = limit
+        self.descending = descending
+
+        self.fields = list(fields) if fields else None
+        unknown = set(self.fields or ()) - set(POKEMON_FIELDS)
+        if unknown:
+            raise InvalidQuery(f"Unknown pokemon fields {sorted(unknown)}.")
+
+        ranges = {
+            "level": [(">=", min_level), ("<=", max_level)],
+            "caught_at": [(">", _naive(caught_after)),
+                          ("<", _naive(caught_before))],
+        }
+        filtered = [
+            field for field, bounds in ranges.items()
+            if any(value is not None for _, value in bounds)
+        ]
+        if len(filtered) > 1 \
+                or filtered and order_by not in (None, filtered[0]):
+            raise InvalidQuery(
+                "Range filters only apply to the field the pokemon are "
+                "ordered by.")
+        self.order_by = order_by or (filtered[0] if filtered else "name")
+        if self.order_by not in ORDER_FIELDS:
+            raise InvalidQuery(f"Pokemon cannot be ordered by "
+                               f"'{self.order_by}', only by {ORDER_FIELDS}.")
+        self.filters: List[Tuple[str, object]] = [
+            (op, value) for op, value in ranges.get(self.order_by, [])
+            if value is not None
+        ]
+        self.after = self._decode_cursor(start_after) \
+            if start_after else None
+
+    @property
+    def read_fields(self) -> Optional[List[str]]:
+        """Fields to read from storage, including the ones needed for the
+        cursor, or None for all of them."""
+        if self.fields is None:
+            return None
+        return list(dict.fromkeys(self.fields + [self.order_by, "name"]))
+
+    def sort_key(self, pokemon: dict) -> tuple:
+        return pokemon[self.order_by], pokemon["name"]
+
+    def matches(self, pokemon: dict) -> bool:
+        """Whether `pokemon` passes the filters and comes after the cursor.
+        """
+        value = pokemon[self.order_by]
+        for op, bound in self.filters:
+            if not _compare(value, op, bound):
+                return False
+        if self.after is None:
+            return True
+        return _compare(self.sort_key(pokemon),
+                        "<" if self.descending else ">", self.after)
+
+    def page(self, trainer: str, pokemon: List[dict]) -> models.TrainerPokemonPage:  # noqa: E501
+        """Build the page from up to ``limit + 1`` sorted and filtered
+        pokemon, the last one telling whether there is a next page."""
+        next_cursor = None
+        if len(pokemon) > self.limit:
+            pokemon = pokemon[:self.limit]
+            next_cursor = self._encode_cursor(pokemon[-1])
+        if self.fields is not None:
+            pokemon = [
+                {field: data[field] for field in self.fields}
+                for data in pokemon
+            ]
+        return models.load(models.TrainerPokemonPage, {
+            "name": trainer,
+            "pokemon": [
+                models.load(models.PartialCaughtPokemon, data)
+                for data in pokemon
+            ],
+            "next_cursor": next_cursor
+        })
+
+    def _encode_cursor(self, pokemon: dict) -> str:
+        value = pokemon[self.order_by]
+        if isinstance(value, datetime):
+            # Firestore returns the naive times it stores as UTC.
+            value = value.replace(tzinfo=None).isoformat()
+        data = json.dumps([self.order_by, value, pokemon["name"]])
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+    def _decode_cursor(self, cursor: str) -> tuple:
+        try:
+            order_by, value, name = json.loads(
+                base64.urlsafe_b64decode(cursor.encode("ascii")))
+            if order_by == "caught_at":
+                value = _naive(datetime.fromisoformat(value))
+        except (binascii.Error, TypeError, ValueError):
+            raise InvalidQuery(f"Invalid cursor '{cursor}'.")
+        if order_by != self.order_by:
+            raise InvalidQuery(
+                f"The cursor is for pokemon ordered by '{order_by}'.")
+        return value, name
+
+
+def _naive(value: Optional[datetime]) -> Optional[datetime]:
+    """`value` in naive local time, like the times the pokemon are stored
+    with."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+def _compare(value, op: str, bound) -> bool:
+    if op == ">":
+        return value > bound
+    if op == ">=":
+        return value >= bound
+    if op == "<":
+        return value < bound
+    return value <= bound
+
+
+class TrainerStore(ABC):
+    """Storage of trainers and the pokemon registered under them."""
+
+    def __init__(self):
+        self.round_trips = RoundTrips()
+
+    @abstractmethod
+    def get_trainer(self, trainer: str) -> models.Trainer:
+        """Retrieve information about a trainer.
+
+        Raises
+        ------
+        ValueError
+            Trainer not found.
+        """
+
+    @abstractmethod
+    def register_trainer(self, name: str, image: str) -> models.Trainer:
+        """Register a given trainer.
+
+        Raises
+        ------
+        ValueError
+            Trainer already registered.
+        """
+
+    @abstractmethod
+    def get_trainer_pokemon_page(
+            self, trainer: str,
+            query: PokemonQuery) -> models.TrainerPokemonPage:
+        """Retrieve a page of the pokemon of the given trainer.
+
+        Raises
+        ------
+        ValueError
+            Trainer not found.
+        """
+
+    @abstractmethod
+    def register_pokemon(self, trainer: str, pokemon: models.RegisterPokemon,
+                         info: models.Pokemon) -> models.RegisterPokemonResponse:  # noqa: E501
+        """Register a pokemon, described by its PokeAPI `info`, to a trainer.
+
+        Raises
+        ------
+        ValueError
+            Trainer not found.
+        """
+
+    @abstractmethod
+    def register_pokemon_batch(
+        self, trainer: str,
+        pokemon: List[Tuple[models.RegisterPokemon, models.Pokemon]]
+    ) -> List[models.RegisterPokemonResponse]:
+        """Register several pokemon, each with its PokeAPI info, to a trainer
+        at once.
+
+        Names must be unique within the batch: `database` keeps the first
+        registration of each name and reports the others as conflicts
+        before calling the store.
+
+        Raises
+        ------
+        ValueError
+            Trainer not found.
+        """
+
+    @abstractmethod
+    def level_up_pokemon(self, trainer: str, pokemon: str,
+                         levels: int) -> models.RegisterPokemonResponse:
+        """Raise the level of a given pokemon by a given amount of levels.
+
+        Raises
+        ------
+        ValueError
+            Trainer not found.
+        ValueError
+            Pokemon not registered under the given trainer.
+        """
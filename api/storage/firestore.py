@@ -0,0 +1,222 @@
+import os
+from datetime import datetime
+from typing import List, Tuple
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.api_core.exceptions import Conflict, NotFound
+from google.cloud.firestore_v1.document import DocumentReference
+
+import models
+from cache import MISSING, TTLCache
+from storage.base import PokemonQuery, TrainerStore
+
+
+# Maximum amount of writes in a single Firestore batch.
+BATCH_LIMIT = 500
+
+
+class FirestoreStore(TrainerStore):
+    """Trainer store backed by Cloud Firestore.
+
+    Trainers are documents of the ``trainers`` collection and their pokemon
+    are documents of a ``pokemon`` subcollection, keyed by pokemon name.
+
+    Parameters
+    ----------
+    project_id : str
+        ID of the GCP project with the Firestore database.
+    credentials_path : str
+        Service account key used if the file exists. Otherwise, the default
+        GCP credentials of the environment are used.
+    """
+
+    def __init__(self, project_id: str, credentials_path: str):
+        super().__init__()
+        if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+            # firebase_admin always requires credentials, which the
+            # emulator does not use.
+            self.db = firestore.Client(project=project_id)
+        else:
+            self.db = self._client(project_id, credentials_path)
+        # Trainers are never deleted, so once a trainer is seen its existence
+        # does not need to be read from Firestore again.
+        self.known_trainers = TTLCache(
+            maxsize=int(os.environ.get("KNOWN_TRAINERS_SIZE", 10000)),
+            ttl=float("inf")
+        )
+
+    @staticmethod
+    def _client(project_id: str, credentials_path: str) -> firestore.Client:
+        try:
+            firestore_app = firebase_admin.get_app()
+        except ValueError:
+            options = {"projectId": project_id}
+            if os.path.exists(credentials_path):
+                firestore_app = firebase_admin.initialize_app(
+                    credentials.Certificate(credentials_path), options=options
+                )
+            else:
+                firestore_app = firebase_admin.initialize_app(options=options)
+        return firestore.client(firestore_app)
+
+    def get_trainer_document(self, trainer: str) -> DocumentReference:
+        return self.db.collection("trainers").document(trainer)
+
+    def _trainer_exists(self, trainer: str) -> bool:
+        if self.known_trainers.get(trainer) is not MISSING:
+            return True
+        self.round_trips.add("read")
+        exists = self.get_trainer_document(trainer).get().exists
+        if exists:
+            self.known_trainers.set(trainer, True)
+        return exists
+
+    def get_trainer(self, trainer: str) -> models.Trainer:
+        self.round_trips.add("read")
+        snapshot = self.get_trainer_document(trainer).get()
+        if not snapshot.exists:
+            raise ValueError(f"Trainer '{trainer}' not found.")
+        self.known_trainers.set(trainer, True)
+        trainer_data = models.load(models.Trainer, snapshot.to_dict())
+        return trainer_data
+
+    def register_trainer(self, name: str, image: str) -> models.Trainer:
+        """Register a given trainer.
+
+        The document is created with a precondition that it does not exist
+        yet, so no read is needed beforehand.
+        """
+        doc = self.get_trainer_document(name)
+        data = {
+            "name": name,
+            "image": image,
+            "registered_at": datetime.now()
+        }
+        try:
+            self.round_trips.add("write")
+            doc.create(data)
+        except Conflict:
+            raise ValueError(f"Trainer '{name}' already registered.")
+        self.known_trainers.set(name, True)
+        trainer_data = models.Trainer.parse_obj(data)
+        return trainer_data
+
+    def get_trainer_pokemon_page(
+            self, trainer: str,
+            query: PokemonQuery) -> models.TrainerPokemonPage:
+        """Retrieve a page of the pokemon of the given trainer.
+
+        Ordering by level or time of capture requires the composite indexes
+        in ``firestore.indexes.json``. Only the requested fields are read,
+        and the trainer document is only read when the first page is empty.
+        """
+        field = query.order_by
+        direction = firestore.Query.DESCENDING if query.descending \
+            else firestore.Query.ASCENDING
+        pokemon_query = self.get_trainer_document(trainer) \
+            .collection("pokemon")
+        for op, value in query.filters:
+            pokemon_query = pokemon_query.where(field, op, value)
+        pokemon_query = pokemon_query.order_by(field, direction=direction)
+        if field != "name":
+            pokemon_query = pokemon_query.order_by("name", direction=direction)
+        if query.read_fields is not None:
+            pokemon_query = pokemon_query.select(query.read_fields)
+        if query.after is not None:
+            value, name = query.after
+            pokemon_query = pokemon_query.start_after(
+                [name] if field == "name" else [value, name])
+        pokemon_query = pokemon_query.limit(query.limit + 1)
+
+        self.round_trips.add("query")
+        docs = [doc.to_dict() for doc in pokemon_query.stream()]
+        if not docs and query.after is None \
+                and not self._trainer_exists(trainer):
+            raise ValueError(f"Trainer '{trainer}' not found.")
+        return query.page(trainer, docs)
+
+    def register_pokemon(self, trainer: str, pokemon: models.RegisterPokemon,
+                         info: models.Pokemon) -> models.RegisterPokemonResponse:  # noqa: E501
+        if not self._trainer_exists(trainer):
+            raise ValueError(f"Trainer '{trainer}' not found.")
+        trainer_doc = self.get_trainer_document(trainer)
+        pokemon_doc = trainer_doc.collection("pokemon").document(info.name)
+        data = {
+            "id": info.id,
+            "name": info.name,
+            "nickname": pokemon.nickname,
+            "level": pokemon.level,
+            "caught_at": datetime.now(),
+            "artwork": info.artwork
+        }
+        self.round_trips.add("write")
+        pokemon_doc.set(data)
+        data["trainer"] = trainer
+        pokemon_data = models.RegisterPokemonResponse.parse_obj(data)
+        return pokemon_data
+
+    def register_pokemon_batch(
+        self, trainer: str,
+        pokemon: List[Tuple[models.RegisterPokemon, models.Pokemon]]
+    ) -> List[models.RegisterPokemonResponse]:
+        """Register several pokemon to a trainer with batched writes.
+
+        The trainer is checked once, and the pokemon are written in batches
+        of up to ``BATCH_LIMIT`` documents. Each batch is atomic, but a
+        failure may leave the earlier batches written.
+        """
+        if not self._trainer_exists(trainer):
+            raise ValueError(f"Trainer '{trainer}' not found.")
+        collection = self.get_trainer_document(trainer).collection("pokemon")
+        caught_at = datetime.now()
+        # Names are unique, as the base class requires, but a document can
+        # only be written once per batch, so repeated names would keep their
+        # first registration, like the API does.
+        documents = {}
+        registered = []
+        for registration, info in pokemon:
+            data = {
+                "id": info.id,
+                "name": info.name,
+                "nickname": registration.nickname,
+                "level": registration.level,
+                "caught_at": caught_at,
+                "artwork": info.artwork
+            }
+            documents.setdefault(info.name, data)
+            registered.append(
+                models.RegisterPokemonResponse(trainer=trainer, **data))
+        names = list(documents)
+        for start in range(0, len(names), BATCH_LIMIT):
+            batch = self.db.batch()
+            for name in names[start:start + BATCH_LIMIT]:
+                batch.set(collection.document(name), documents[name])
+            self.round_trips.add("write")
+            batch.commit()
+        return registered
+
+    def level_up_pokemon(self, trainer: str, pokemon: str,
+                         levels: int) -> models.RegisterPokemonResponse:
+        """Raise the level of a given pokemon by a given amount of levels.
+
+        The level is raised with an atomic ``Increment`` transform, so
+        concurrent level ups do not overwrite each other. The trainer is only
+        looked up when the pokemon document does not exist.
+        """
+        trainer_doc = self.get_trainer_document(trainer)
+        pokemon_doc = trainer_doc.collection("pokemon").document(pokemon)
+        try:
+            self.round_trips.add("write")
+            pokemon_doc.update({"level": firestore.Increment(levels)})
+        except NotFound:
+            if not self._trainer_exists(trainer):
+                raise ValueError(f"Trainer '{trainer}' not found.")
+            raise ValueError(
+                f"Pokemon '{pokemon}' not registered for trainer '{trainer}'.",
+            )
+        self.round_trips.add("read")
+        data = pokemon_doc.get().to_dict()
+        data["trainer"] = trainer
+        pokemon_data = models.load(models.RegisterPokemonResponse, data)
+        return pokemon_data
@@ -0,0 +1,114 @@
+import threading
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import models
+from storage.base import PokemonQuery, TrainerStore
+
+
+class MemoryStore(TrainerStore):
+    """Trainer store kept in process memory, indexed by trainer name.
+
+    Data is lost when the process exits. Meant for local development and
+    load testing without any external service.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._trainers: Dict[str, dict] = {}
+        self._pokemon: Dict[str, Dict[str, dict]] = {}
+        self._lock = threading.Lock()
+
+    def get_trainer(self, trainer: str) -> models.Trainer:
+        self.round_trips.add("read")
+        data = self._trainers.get(trainer)
+        if data is None:
+            raise ValueError(f"Trainer '{trainer}' not found.")
+        return models.load(models.Trainer, data)
+
+    def register_trainer(self, name: str, image: str) -> models.Trainer:
+        data = {
+            "name": name,
+            "image": image,
+            "registered_at": datetime.now()
+        }
+        self.round_trips.add("write")
+        with self._lock:
+            if name in self._trainers:
+                raise ValueError(f"Trainer '{name}' already registered.")
+            self._trainers[name] = data
+            self._pokemon[name] = {}
+        return models.Trainer.parse_obj(data)
+
+    def get_trainer_pokemon_page(
+            self, trainer: str,
+            query: PokemonQuery) -> models.TrainerPokemonPage:
+        self.round_trips.add("query")
+        with self._lock:
+            pokemon = self._pokemon.get(trainer)
+            if pokemon is None:
+                raise ValueError(f"Trainer '{trainer}' not found.")
+            matches = [data for data in pokemon.values()
+                       if query.matches(data)]
+        matches.sort(key=query.sort_key, reverse=query.descending)
+        return query.page(trainer, matches[:query.limit + 1])
+
+    def register_pokemon(self, trainer: str, pokemon: models.RegisterPokemon,
+                         info: models.Pokemon) -> models.RegisterPokemonResponse:  # noqa: E501
+        data = {
+            "id": info.id,
+            "name": info.name,
+            "nickname": pokemon.nickname,
+            "level": pokemon.level,
+            "caught_at": datetime.now(),
+            "artwork": info.artwork
+        }
+        self.round_trips.add("write")
+        with self._lock:
+            if trainer not in self._pokemon:
+                raise ValueError(f"Trainer '{trainer}' not found.")
+            self._pokemon[trainer][info.name] = data
+        return models.RegisterPokemonResponse(trainer=trainer, **data)
+
+    def register_pokemon_batch(
+        self, trainer: str,
+        pokemon: List[Tuple[models.RegisterPokemon, models.Pokemon]]
+    ) -> List[models.RegisterPokemonResponse]:
+        caught_at = datetime.now()
+        registered = [
+            {
+                "id": info.id,
+                "name": info.name,
+                "nickname": registration.nickname,
+                "level": registration.level,
+                "caught_at": caught_at,
+                "artwork": info.artwork
+            }
+            for registration, info in pokemon
+        ]
+        self.round_trips.add("write")
+        with self._lock:
+            if trainer not in self._pokemon:
+                raise ValueError(f"Trainer '{trainer}' not found.")
+            for data in registered:
+                self._pokemon[trainer][data["name"]] = data
+        return [
+            models.RegisterPokemonResponse(trainer=trainer, **data)
+            for data in registered
+        ]
+
+    def level_up_pokemon(self, trainer: str, pokemon: str,
+                         levels: int) -> models.RegisterPokemonResponse:
+        self.round_trips.add("write")
+        with self._lock:
+            if trainer not in self._pokemon:
+                raise ValueError(f"Trainer '{trainer}' not found.")
+            data = self._pokemon[trainer].get(pokemon)
+            if data is None:
+                raise ValueError(
+                    f"Pokemon '{pokemon}' not registered for trainer "
+                    f"'{trainer}'.",
+                )
+            data["level"] = data["level"] + levels
+            data = dict(data, trainer=trainer)
+        return models.load(models.RegisterPokemonResponse, data)
@@ -0,0 +1,210 @@
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Tuple
+
+import models
+from storage.base import PokemonQuery, TrainerStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trainers (
+    name TEXT PRIMARY KEY,
+    image TEXT NOT NULL,
+    registered_at TEXT
+);
+CREATE TABLE IF NOT EXISTS pokemon (
+    trainer TEXT NOT NULL REFERENCES trainers (name),
+    name TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    nickname TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    caught_at TEXT NOT NULL,
+    artwork TEXT NOT NULL,
+    PRIMARY KEY (trainer, name)
+);
+CREATE INDEX IF NOT EXISTS pokemon_level
+    ON pokemon (trainer, level, name);
+CREATE INDEX IF NOT EXISTS pokemon_caught_at
+    ON pokemon (trainer, caught_at, name);
+"""
+
+POKEMON_COLUMNS = ("id", "name", "nickname", "level", "caught_at", "artwork")
+
+
+class SQLiteStore(TrainerStore):
+    """Trainer store backed by a local SQLite database in WAL mode.
+
+    Each thread of the I/O pool keeps its own connection, so reads run
+    concurrently with writes. Pokemon are indexed by trainer through the
+    ``(trainer, name)`` primary key.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _trainer_exists(self, connection: sqlite3.Connection,
+                        trainer: str) -> bool:
+        self.round_trips.add("read")
+        row = connection.execute(
+            "SELECT 1 FROM trainers WHERE name = ?", (trainer,)
+        ).fetchone()
+        return row is not None
+
+    def get_trainer(self, trainer: str) -> models.Trainer:
+        self.round_trips.add("read")
+        row = self._connection().execute(
+            "SELECT * FROM trainers WHERE name = ?", (trainer,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"Trainer '{trainer}' not found.")
+        return models.load(models.Trainer, dict(row))
+
+    def register_trainer(self, name: str, image: str) -> models.Trainer:
+        data = {
+            "name": name,
+            "image": image,
+            "registered_at": datetime.now()
+        }
+        self.round_trips.add("write")
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    "INSERT INTO trainers VALUES (?, ?, ?)",
+                    (name, image, data["registered_at"].isoformat())
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Trainer '{name}' already registered.")
+        return models.Trainer.parse_obj(data)
+
+    def get_trainer_pokemon_page(
+            self, trainer: str,
+            query: PokemonQuery) -> models.TrainerPokemonPage:
+        """Retrieve a page of the pokemon of the given trainer.
+
+        The pokemon are read in order from the index of the ordered field,
+        starting after the cursor, so only one page of rows is read.
+        """
+        field = query.order_by
+        conditions = ["trainer = ?"]
+        params = [trainer]
+        for op, value in query.filters:
+            conditions.append(f"{field} {op} ?")
+            params.append(_to_sql(value))
+        if query.after is not None:
+            value, name = query.after
+            op = "<" if query.descending else ">"
+            conditions.append(
+                f"({field} {op} ? OR ({field} = ? AND name {op} ?))")
+            params.extend([_to_sql(value), _to_sql(value), name])
+        direction = "DESC" if query.descending else "ASC"
+        columns = query.read_fields or POKEMON_COLUMNS
+
+        connection = self._connection()
+        self.round_trips.add("query")
+        rows = connection.execute(
+            f"SELECT {', '.join(columns)} FROM pokemon "
+            f"WHERE {' AND '.join(conditions)} "
+            f"ORDER BY {field} {direction}, name {direction} LIMIT ?",
+            params + [query.limit + 1]
+        ).fetchall()
+        if not rows and query.after is None \
+                and not self._trainer_exists(connection, trainer):
+            raise ValueError(f"Trainer '{trainer}' not found.")
+        return query.page(trainer, [dict(row) for row in rows])
+
+    def register_pokemon(self, trainer: str, pokemon: models.RegisterPokemon,
+                         info: models.Pokemon) -> models.RegisterPokemonResponse:  # noqa: E501
+        data = {
+            "id": info.id,
+            "name": info.name,
+            "nickname": pokemon.nickname,
+            "level": pokemon.level,
+            "caught_at": datetime.now(),
+            "artwork": info.artwork
+        }
+        with self._connection() as connection:
+            if not self._trainer_exists(connection, trainer):
+                raise ValueError(f"Trainer '{trainer}' not found.")
+            self.round_trips.add("write")
+            connection.execute(
+                "INSERT OR REPLACE INTO pokemon VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (trainer, info.name, info.id, pokemon.nickname,
+                 pokemon.level, data["caught_at"].isoformat(), info.artwork)
+            )
+        return models.RegisterPokemonResponse(trainer=trainer, **data)
+
+    def register_pokemon_batch(
+        self, trainer: str,
+        pokemon: List[Tuple[models.RegisterPokemon, models.Pokemon]]
+    ) -> List[models.RegisterPokemonResponse]:
+        """Register several pokemon to a trainer in a single transaction."""
+        caught_at = datetime.now()
+        rows = [
+            (trainer, info.name, info.id, registration.nickname,
+             registration.level, caught_at.isoformat(), info.artwork)
+            for registration, info in pokemon
+        ]
+        with self._connection() as connection:
+            if not self._trainer_exists(connection, trainer):
+                raise ValueError(f"Trainer '{trainer}' not found.")
+            self.round_trips.add("write")
+            connection.executemany(
+                "INSERT OR REPLACE INTO pokemon VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return [
+            models.RegisterPokemonResponse(
+                trainer=trainer, id=info.id, name=info.name,
+                nickname=registration.nickname, level=registration.level,
+                caught_at=caught_at, artwork=info.artwork)
+            for registration, info in pokemon
+        ]
+
+    def level_up_pokemon(self, trainer: str, pokemon: str,
+                         levels: int) -> models.RegisterPokemonResponse:
+        with self._connection() as connection:
+            self.round_trips.add("write")
+            updated = connection.execute(
+                "UPDATE pokemon SET level = level + ? "
+                "WHERE trainer = ? AND name = ?",
+                (levels, trainer, pokemon)
+            ).rowcount
+            if not updated:
+                if not self._trainer_exists(connection, trainer):
+                    raise ValueError(f"Trainer '{trainer}' not found.")
+                raise ValueError(
+                    f"Pokemon '{pokemon}' not registered for trainer "
+                    f"'{trainer}'.",
+                )
+            self.round_trips.add("read")
+            row = connection.execute(
+                f"SELECT {', '.join(POKEMON_COLUMNS)} FROM pokemon "
+                "WHERE trainer = ? AND name = ?", (trainer, pokemon)
+            ).fetchone()
+        return models.load(models.RegisterPokemonResponse,
+                           dict(row, trainer=trainer))
+
+
+def _to_sql(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
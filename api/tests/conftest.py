@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The API modules are imported flat, as in the server image.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from cache import GroupedCache, SingleFlight
+
+
+def test_grouped_cache_serves_hits_until_invalidated():
+    cache = GroupedCache()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {"level": 1}
+
+    first = cache.get("red", "page", load)
+    assert cache.get("red", "page", load) is first
+    cache.invalidate("red")
+    cache.get("red", "page", load)
+
+    assert len(loads) == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_grouped_cache_keeps_etag_of_unchanged_value():
+    cache = GroupedCache()
+    value = {"level": 1}
+
+    first = cache.get("red", "page", lambda: dict(value))
+    cache.invalidate("red")
+    unchanged = cache.get("red", "page", lambda: dict(value))
+    value["level"] = 2
+    cache.invalidate("red")
+    changed = cache.get("red", "page", lambda: dict(value))
+
+    assert unchanged.etag == first.etag
+    assert changed.etag != first.etag
+    assert changed.value == {"level": 2}
+
+
+def test_grouped_cache_invalidation_only_affects_its_group():
+    cache = GroupedCache()
+    blue = cache.get("blue", "page", lambda: 1)
+
+    cache.invalidate("red")
+
+    assert cache.get("blue", "page", lambda: 2) is blue
+
+
+def test_grouped_cache_skips_values_loaded_during_invalidation():
+    cache = GroupedCache()
+
+    def load():
+        cache.invalidate("red")
+        return "stale"
+
+    assert cache.get("red", "page", load).value == "stale"
+    assert cache.get("red", "page", lambda: "fresh").value == "fresh"
+
+
+def test_grouped_cache_does_not_cache_errors():
+    cache = GroupedCache()
+
+    def fail():
+        raise ValueError("Trainer 'red' not found.")
+
+    with pytest.raises(ValueError):
+        cache.get("red", "trainer", fail)
+    assert cache.get("red", "trainer", lambda: "red").value == "red"
+
+
+def test_single_flight_shares_one_call():
+    flights = SingleFlight()
+    started = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return "pikachu"
+
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(flights.do(25, call)))
+    leader.start()
+    started.wait()
+    results.append(flights.do(25, call))
+    leader.join()
+
+    assert results == ["pikachu", "pikachu"]
+    assert len(calls) == 1
+    assert flights.stats()["coalesced"] == 1
+
+
+def test_single_flight_propagates_errors_to_waiters():
+    flights = SingleFlight()
+    started = threading.Event()
+
+    def call():
+        started.set()
+        time.sleep(0.05)
+        raise ValueError("Pokemon '0' not found.")
+
+    errors = []
+
+    def leader():
+        try:
+            flights.do(0, call)
+        except ValueError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait()
+    with pytest.raises(ValueError):
+        flights.do(0, call)
+    thread.join()
+
+    assert len(errors) == 1
+    # The failed call is not remembered.
+    assert flights.do(0, lambda: "retried") == "retried"
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_single_flight_waiters_time_out():
+    flights = SingleFlight(timeout=0.01)
+    release = threading.Event()
+    started = threading.Event()
+
+    def call():
+        started.set()
+        release.wait()
+        return "slow"
+
+    thread = threading.Thread(target=lambda: flights.do(1, call))
+    thread.start()
+    started.wait()
+    with pytest.raises(TimeoutError):
+        flights.do(1, call)
+    release.set()
+    thread.join()
+
+    assert flights.stats()["timeouts"] == 1
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import models
+from storage import InvalidQuery, PokemonQuery
+from storage.memory import MemoryStore
+
+TRAINER = "red"
+LEVELS = [12, 5, 30, 5, 18, 7, 30, 1, 25, 9]
+
+
+@pytest.fixture
+def store():
+    store = MemoryStore()
+    store.register_trainer(TRAINER, "red.png")
+    for number, level in enumerate(LEVELS, start=1):
+        store.register_pokemon(
+            TRAINER,
+            models.RegisterPokemon(id=number, nickname=f"mon {number}",
+                                   level=level),
+            models.Pokemon(id=number, name=f"pokemon-{number:02}",
+                           artwork=f"{number}.png"))
+    return store
+
+
+def read_all(store: MemoryStore, limit: int, **kwargs) -> list:
+    """Follow the cursors from the first page to the last one."""
+    pokemon, cursor = [], None
+    while True:
+        page = store.get_trainer_pokemon_page(
+            TRAINER, PokemonQuery(limit, start_after=cursor, **kwargs))
+        assert len(page.pokemon) <= limit
+        pokemon += page.pokemon
+        cursor = page.next_cursor
+        if cursor is None:
+            return pokemon
+
+
+@pytest.mark.parametrize("limit", [1, 3, 10, 11])
+def test_cursors_cover_every_pokemon_once_by_name(store, limit):
+    names = [p.name for p in read_all(store, limit)]
+
+    assert names == sorted(f"pokemon-{n:02}" for n in range(1, 11))
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_cursors_break_level_ties_by_name(store, descending):
+    pokemon = read_all(store, 3, order_by="level", descending=descending)
+
+    keys = [(p.level, p.name) for p in pokemon]
+    assert keys == sorted(keys, reverse=descending)
+    assert len(keys) == len(LEVELS)
+
+
+def test_cursors_round_trip_caught_at(store):
+    pokemon = read_all(store, 4, order_by="caught_at")
+
+    keys = [(p.caught_at, p.name) for p in pokemon]
+    assert keys == sorted(keys)
+    assert len(keys) == len(LEVELS)
+
+
+def test_level_range_filters_pages(store):
+    pokemon = read_all(store, 2, min_level=7, max_level=25)
+
+    assert [p.level for p in pokemon] == [7, 9, 12, 18, 25]
+
+
+def test_caught_at_bounds_with_timezone(store):
+    past = datetime.now(timezone.utc) - timedelta(hours=1)
+    future = datetime.now(timezone(timedelta(hours=-5))) + timedelta(hours=1)
+
+    assert len(read_all(store, 4, caught_after=past)) == len(LEVELS)
+    assert read_all(store, 4, caught_after=future) == []
+    assert len(read_all(store, 4, caught_before=future)) == len(LEVELS)
+
+
+def test_fields_select_returned_fields(store):
+    page = store.get_trainer_pokemon_page(
+        TRAINER, PokemonQuery(2, fields=["name", "level"]))
+
+    assert page.pokemon[0].dict(exclude_unset=True) == {
+        "name": "pokemon-01", "level": 12}
+    assert page.next_cursor is not None
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"limit": 0},
+    {"limit": 5, "fields": ["name", "weight"]},
+    {"limit": 5, "order_by": "nickname"},
+    {"limit": 5, "order_by": "name", "min_level": 3},
+    {"limit": 5, "min_level": 3,
+     "caught_after": datetime(2020, 1, 1)},
+    {"limit": 5, "start_after": "not a cursor"},
+])
+def test_invalid_queries(kwargs):
+    with pytest.raises(InvalidQuery):
+        PokemonQuery(**kwargs)
+
+
+def test_cursor_of_another_order_is_rejected(store):
+    cursor = store.get_trainer_pokemon_page(
+        TRAINER, PokemonQuery(2, order_by="level")).next_cursor
+
+    with pytest.raises(InvalidQuery):
+        PokemonQuery(2, start_after=cursor)
+
+
+def test_unknown_trainer_is_not_an_invalid_query(store):
+    with pytest.raises(ValueError) as error:
+        store.get_trainer_pokemon_page("blue", PokemonQuery(2))
+
+    assert not isinstance(error.value, InvalidQuery)
@@ -0,0 +1,187 @@
+import threading
+import time
+
+import pytest
+
+import models
+from storage import PokemonQuery
+from storage.memory import MemoryStore
+from writebehind import LevelUpBuffer
+
+TRAINER = "red"
+PIKACHU = models.Pokemon(id=25, name="pikachu", artwork="pikachu.png")
+EEVEE = models.Pokemon(id=133, name="eevee", artwork="eevee.png")
+
+
+class Store:
+    """Memory store recording the level ups written to it, optionally
+    failing the next ones."""
+
+    def __init__(self):
+        self.store = MemoryStore()
+        self.store.register_trainer(TRAINER, "red.png")
+        for info in (PIKACHU, EEVEE):
+            self.register(info, level=5)
+        self.writes = []
+        self.failures = []
+        self.delay = 0.0
+
+    def register(self, info: models.Pokemon, level: int):
+        self.store.register_pokemon(
+            TRAINER, models.RegisterPokemon(id=info.id, nickname=info.name,
+                                            level=level), info)
+
+    def level(self, name: str) -> int:
+        page = self.store.get_trainer_pokemon_page(
+            TRAINER, PokemonQuery(100))
+        return next(p.level for p in page.pokemon if p.name == name)
+
+    def level_up(self, trainer: str, pokemon: str, levels: int):
+        time.sleep(self.delay)
+        if self.failures:
+            raise self.failures.pop(0)
+        self.writes.append((pokemon, levels))
+        return self.store.level_up_pokemon(trainer, pokemon, levels)
+
+
+@pytest.fixture
+def store():
+    return Store()
+
+
+@pytest.fixture
+def buffer(store):
+    buffer = LevelUpBuffer(store.level_up, interval=3600, max_keys=100)
+    yield buffer
+    buffer.close()
+
+
+def test_first_level_up_is_written_through(store, buffer):
+    response = buffer.level_up(TRAINER, "pikachu", 2)
+
+    assert response.level == 7
+    assert store.writes == [("pikachu", 2)]
+    assert store.level("pikachu") == 7
+    assert buffer.stats()["written_through"] == 1
+
+
+def test_first_level_up_of_unknown_pokemon_raises(buffer):
+    with pytest.raises(ValueError):
+        buffer.level_up(TRAINER, "mew", 1)
+
+    assert buffer.stats()["pokemon"] == 0
+
+
+def test_later_level_ups_are_coalesced(store, buffer):
+    buffer.level_up(TRAINER, "pikachu", 1)
+    responses = [buffer.level_up(TRAINER, "pikachu", 1) for _ in range(3)]
+
+    assert [r.level for r in responses] == [7, 8, 9]
+    assert store.level("pikachu") == 6
+
+    assert buffer.flush() == 0
+    assert store.writes == [("pikachu", 1), ("pikachu", 3)]
+    assert store.level("pikachu") == 9
+
+
+def test_close_flushes_pending_level_ups(store, buffer):
+    buffer.level_up(TRAINER, "pikachu", 1)
+    buffer.level_up(TRAINER, "pikachu", 4)
+    buffer.level_up(TRAINER, "eevee", 1)
+    buffer.level_up(TRAINER, "eevee", 2)
+
+    buffer.close()
+
+    assert store.level("pikachu") == 10
+    assert store.level("eevee") == 8
+    # Level ups after closing are written through.
+    assert buffer.level_up(TRAINER, "pikachu", 1).level == 11
+    assert store.level("pikachu") == 11
+
+
+def test_failed_write_is_retried_on_next_flush(store, buffer):
+    buffer.level_up(TRAINER, "pikachu", 1)
+    buffer.level_up(TRAINER, "pikachu", 2)
+    store.failures.append(RuntimeError("unavailable"))
+
+    assert buffer.flush() == 2
+    assert store.level("pikachu") == 6
+    assert buffer.stats()["failed_writes"] == 1
+    # Level ups arriving meanwhile join the retried ones.
+    assert buffer.level_up(TRAINER, "pikachu", 1).level == 9
+
+    assert buffer.flush() == 0
+    assert store.level("pikachu") == 9
+    assert store.writes[-1] == ("pikachu", 3)
+
+
+def test_level_ups_of_missing_pokemon_are_dropped(store, buffer):
+    buffer.level_up(TRAINER, "pikachu", 1)
+    buffer.level_up(TRAINER, "pikachu", 2)
+    store.failures.append(ValueError("Pokemon 'pikachu' not registered."))
+
+    assert buffer.flush() == 0
+    stats = buffer.stats()
+    assert stats["pokemon"] == 0
+    assert stats["dropped_levels"] == 2
+
+
+def test_discard_drops_pending_level_ups(store, buffer):
+    buffer.level_up(TRAINER, "pikachu", 1)
+    buffer.level_up(TRAINER, "pikachu", 2)
+
+    buffer.discard(TRAINER, ["pikachu"])
+    store.register(PIKACHU, level=1)
+    buffer.flush()
+
+    assert store.level("pikachu") == 1
+    assert buffer.stats()["dropped_levels"] == 2
+
+
+def test_discard_waits_for_write_in_flight(store, buffer):
+    buffer.level_up(TRAINER, "pikachu", 1)
+    buffer.level_up(TRAINER, "pikachu", 2)
+    store.delay = 0.1
+    flush = threading.Thread(target=buffer.flush)
+    flush.start()
+    time.sleep(0.02)
+
+    buffer.discard(TRAINER, ["pikachu"])
+    # The registration lands after the write, which it overwrites.
+    store.register(PIKACHU, level=1)
+    flush.join()
+
+    assert store.level("pikachu") == 1
+
+
+def test_concurrent_first_level_ups_write_through_once(store, buffer):
+    store.delay = 0.05
+    levels = []
+    threads = [
+        threading.Thread(target=lambda: levels.append(
+            buffer.level_up(TRAINER, "pikachu", 1).level))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.writes == [("pikachu", 1)]
+    assert sorted(levels) == [6, 7, 8, 9]
+    buffer.flush()
+    assert store.level("pikachu") == 9
+
+
+def test_max_keys_triggers_flush(store):
+    buffer = LevelUpBuffer(store.level_up, interval=3600, max_keys=2)
+    try:
+        buffer.level_up(TRAINER, "pikachu", 1)
+        buffer.level_up(TRAINER, "eevee", 1)
+        buffer.level_up(TRAINER, "eevee", 1)
+        deadline = time.monotonic() + 5
+        while store.level("eevee") != 7 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.level("eevee") == 7
+    finally:
+        buffer.close()
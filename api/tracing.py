@@ -0,0 +1,90 @@
+"""Per-request timings of the phases of a request.
+
+`kafka_logging` starts a trace for each request, and `span` adds the time
+spent in a block of code to a phase of the current trace, e.g. a call to the
+PokeAPI. Traces are kept in a context variable, which `concurrency.run_io`
+copies to the I/O threads, so spans work the same in handlers and in the
+blocking calls they offload. Outside of a trace, spans only cost a lookup.
+
+Spans of the same phase may overlap, e.g. the PokeAPI calls of a batch
+registration gathered in parallel, so a phase is the wall-clock time during
+which at least one of its spans was running, not the sum of their durations.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Dict, List, Optional, Tuple
+
+
+class _Trace:
+    """Spans of each phase of a request, as ``(start, end)`` intervals,
+    recorded from the threads the request runs on."""
+
+    __slots__ = ("lock", "spans")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans: Dict[str, List[Tuple[float, float]]] = {}
+
+    def add(self, phase: str, start_time: float, end_time: float):
+        with self.lock:
+            self.spans.setdefault(phase, []).append((start_time, end_time))
+
+    def phases(self) -> Dict[str, float]:
+        with self.lock:
+            return {phase: _union(spans)
+                    for phase, spans in self.spans.items()}
+
+
+_trace: ContextVar[Optional[_Trace]] = ContextVar("trace", default=None)
+
+
+def start() -> Token:
+    """Start a trace in the current context."""
+    return _trace.set(_Trace())
+
+
+def finish(token: Token) -> Dict[str, float]:
+    """End the trace started with `token`, returning the seconds spent in
+    each phase."""
+    trace = _trace.get()
+    _trace.reset(token)
+    return trace.phases() if trace is not None else {}
+
+
+def add(phase: str, seconds: float):
+    """Add the `seconds` that just elapsed to a phase of the current trace,
+    if any."""
+    trace = _trace.get()
+    if trace is not None:
+        end_time = time.perf_counter()
+        trace.add(phase, end_time - seconds, end_time)
+
+
+@contextmanager
+def span(phase: str):
+    """Add the time spent in the block to a phase of the current trace."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(phase, start_time, time.perf_counter())
+
+
+def _union(spans: List[Tuple[float, float]]) -> float:
+    """Seconds covered by at least one of `spans`."""
+    total = 0.0
+    current_start, current_end = None, None
+    for start_time, end_time in sorted(spans):
+        if current_end is None or start_time > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start_time, end_time
+        else:
+            current_end = max(current_end, end_time)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
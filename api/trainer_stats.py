@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import models
+
+# Orders of the leaderboard, each backed by an index of the stats database.
+LEADERBOARD_ORDERS = ("pokemon_count", "caught", "average_level", "max_level",
+                      "last_activity")
+
+STATS_COLUMNS = ("trainer", "pokemon_count", "caught", "average_level",
+                 "max_level", "most_caught_species",
+                 "most_caught_species_count", "last_activity")
+
+
+class TrainerStatsReader:
+    """Read side of the statistics of each trainer, materialized from the
+    Kafka topics by ``prometheus/materializer.py``.
+
+    Reads are a lookup or an index scan on the SQLite database written by
+    the materializer, so they cost the same no matter how many pokemon the
+    trainers have. Each thread of the I/O pool keeps its own read-only
+    connection.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database written by the materializer.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Connecting would create an empty database otherwise.
+            if not os.path.exists(self.path):
+                raise ValueError("Trainer stats are not available yet.")
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA query_only=ON")
+            self._local.connection = connection
+        return connection
+
+    def get(self, trainer: str) -> models.TrainerStats:
+        """Retrieve the statistics of a trainer.
+
+        Raises
+        ------
+        ValueError
+            No stats for the trainer.
+        """
+        row = self._connection().execute(
+            f"SELECT {', '.join(STATS_COLUMNS)} FROM trainer_stats "
+            f"WHERE trainer = ?", (trainer,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"No stats for trainer '{trainer}'.")
+        return _load(row)
+
+    def leaderboard(self, by: str, limit: int) -> models.Leaderboard:
+        """Retrieve the statistics of the `limit` top trainers by `by`.
+
+        Raises
+        ------
+        ValueError
+            Invalid order.
+        """
+        if by not in LEADERBOARD_ORDERS:
+            raise ValueError(f"Trainers cannot be ranked by '{by}', only by "
+                             f"{LEADERBOARD_ORDERS}.")
+        rows = self._connection().execute(
+            f"SELECT {', '.join(STATS_COLUMNS)} FROM trainer_stats "
+            f"ORDER BY {by} DESC, trainer LIMIT ?", (limit,)
+        ).fetchall()
+        return models.load(models.Leaderboard, {
+            "by": by,
+            "trainers": [_load(row) for row in rows]
+        })
+
+
+def _load(row: sqlite3.Row) -> models.TrainerStats:
+    data = dict(row)
+    if data["last_activity"] is not None:
+        data["last_activity"] = datetime.fromtimestamp(
+            data["last_activity"], timezone.utc)
+    return models.load(models.TrainerStats, data)
@@ -0,0 +1,242 @@
+import logging
+import threading
+from typing import Callable, Dict, Iterable, Tuple
+
+import models
+
+logger = logging.getLogger(__name__)
+
+LevelUp = Callable[[str, str, int], models.RegisterPokemonResponse]
+
+
+class _Entry:
+    """Level ups of a pokemon waiting to be written, on top of its last
+    known state, which is None until its first level up is written."""
+
+    __slots__ = ("base", "pending", "flushing", "writing", "discarded")
+
+    def __init__(self):
+        self.base = None
+        self.pending = 0
+        self.flushing = 0
+        # Whether a write of the pokemon is in flight, and whether the
+        # pokemon was registered again since the entry was created.
+        self.writing = False
+        self.discarded = False
+
+    def project(self) -> models.RegisterPokemonResponse:
+        levels = self.flushing + self.pending
+        return self.base.copy(update={"level": self.base.level + levels})
+
+
+class LevelUpBuffer:
+    """Write-behind buffer of level ups, coalesced per pokemon.
+
+    The first level up of a pokemon is written through, which checks that
+    the pokemon exists and returns its stored state. Level ups of the same
+    pokemon arriving meanwhile wait for that state, and further ones are
+    only added up in memory, answered with the level the pokemon will have
+    once they are written, and written together as a single increment every
+    `interval` seconds, or as soon as `max_keys` pokemon are buffered.
+    Pokemon with no pending level ups when the buffer is flushed are dropped
+    from it.
+
+    A hot pokemon is then written about once per interval, however many
+    times it is leveled up. Level ups that fail to be written are retried
+    on the next flush, unless the pokemon no longer exists.
+
+    Parameters
+    ----------
+    level_up : callable
+        Writes ``level_up(trainer, pokemon, levels)`` to storage, returning
+        the pokemon after the increment.
+    interval : float
+        Seconds between flushes.
+    max_keys : int
+        Amount of buffered pokemon that triggers an early flush.
+    """
+
+    def __init__(self, level_up: LevelUp, interval: float, max_keys: int):
+        self.interval = interval
+        self.max_keys = max_keys
+        self._level_up = level_up
+        self._entries: Dict[Tuple[str, str], _Entry] = {}
+        # Notified whenever a write of a pokemon completes.
+        self._written = threading.Condition()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self.written_through = 0
+        self.buffered = 0
+        self.flushed_writes = 0
+        self.failed_writes = 0
+        self.dropped_levels = 0
+        self._thread = threading.Thread(
+            target=self._run, name="mpa-level-up-buffer", daemon=True)
+        self._thread.start()
+
+    def level_up(self, trainer: str, pokemon: str,
+                 levels: int) -> models.RegisterPokemonResponse:
+        """Raise the level of a pokemon, returning its projected state.
+
+        Raises
+        ------
+        ValueError
+            Trainer not found, or pokemon not registered under the trainer,
+            when the level up is written through.
+        """
+        key = (trainer, pokemon)
+        with self._written:
+            entry = self._entries.get(key)
+            while entry is not None and entry.base is None:
+                self._written.wait()
+                entry = self._entries.get(key)
+            if self._closed.is_set():
+                entry = None
+            elif entry is not None:
+                entry.pending += levels
+                self.buffered += 1
+                if len(self._entries) >= self.max_keys:
+                    self._wake.set()
+                return entry.project()
+            else:
+                entry = _Entry()
+                entry.writing = True
+                self._entries[key] = entry
+
+        if entry is None:
+            return self._level_up(trainer, pokemon, levels)
+        try:
+            base = self._level_up(trainer, pokemon, levels)
+        except BaseException:
+            with self._written:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                entry.writing = False
+                self._written.notify_all()
+            raise
+        # Level ups waiting for the entry are projected from this base.
+        with self._written:
+            entry.base = base
+            entry.writing = False
+            self.written_through += 1
+            self._written.notify_all()
+        return base
+
+    def discard(self, trainer: str, pokemon: Iterable[str]):
+        """Forget the pending level ups of pokemon about to be registered
+        again, which replaces their level.
+
+        Writes of these pokemon already in flight are waited for, so that
+        they are overwritten by the registration instead of landing on it.
+        """
+        with self._written:
+            entries = []
+            for name in pokemon:
+                entry = self._entries.pop((trainer, name), None)
+                if entry is not None:
+                    entry.discarded = True
+                    # Levels being flushed are dropped too, unless their
+                    # write already started.
+                    self.dropped_levels += entry.pending
+                    if not entry.writing:
+                        self.dropped_levels += entry.flushing
+                    entries.append(entry)
+            while any(entry.writing for entry in entries):
+                self._written.wait()
+
+    def flush(self) -> int:
+        """Write the pending level ups of every buffered pokemon.
+
+        Returns
+        -------
+        int
+            Levels still pending after the flush, because their write failed.
+        """
+        with self._written:
+            batch = []
+            for key, entry in list(self._entries.items()):
+                if entry.writing:
+                    continue
+                if not entry.pending:
+                    del self._entries[key]
+                    continue
+                entry.flushing, entry.pending = entry.pending, 0
+                batch.append((key, entry))
+
+        for (trainer, pokemon), entry in batch:
+            with self._written:
+                # Discarded since the batch was taken.
+                if entry.discarded:
+                    continue
+                entry.writing = True
+            try:
+                base = self._level_up(trainer, pokemon, entry.flushing)
+            except ValueError as e:
+                with self._written:
+                    if self._entries.get((trainer, pokemon)) is entry:
+                        del self._entries[(trainer, pokemon)]
+                    self.dropped_levels += entry.flushing
+                    if not entry.discarded:
+                        self.dropped_levels += entry.pending
+                    entry.flushing = 0
+                logger.warning(f"Dropped level ups of pokemon '{pokemon}' "
+                               f"of trainer '{trainer}': {e}")
+            except Exception as e:
+                with self._written:
+                    if not entry.discarded:
+                        entry.pending += entry.flushing
+                    entry.flushing = 0
+                    self.failed_writes += 1
+                logger.error(f"Failed to write level ups of pokemon "
+                             f"'{pokemon}' of trainer '{trainer}', retrying "
+                             f"on the next flush. Error - {str(e)}")
+            else:
+                with self._written:
+                    entry.base = base
+                    entry.flushing = 0
+                    self.flushed_writes += 1
+            finally:
+                with self._written:
+                    entry.writing = False
+                    self._written.notify_all()
+
+        with self._written:
+            return sum(entry.pending for entry in self._entries.values())
+
+    def close(self, attempts: int = 3):
+        """Stop the flush thread and write every pending level up.
+
+        Level ups arriving afterwards are written through.
+        """
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+        remaining = 0
+        for _ in range(attempts):
+            remaining = self.flush()
+            if not remaining:
+                break
+        if remaining:
+            logger.error(f"{remaining} levels not written to storage before "
+                         f"shutdown.")
+
+    def stats(self) -> dict:
+        with self._written:
+            return {
+                "pokemon": len(self._entries),
+                "pending_levels": sum(
+                    entry.pending + entry.flushing
+                    for entry in self._entries.values()),
+                "written_through": self.written_through,
+                "buffered": self.buffered,
+                "flushed_writes": self.flushed_writes,
+                "failed_writes": self.failed_writes,
+                "dropped_levels": self.dropped_levels
+            }
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._closed.is_set():
+                self.flush()
@@ -0,0 +1,53 @@
+"""Measure how many in-flight requests a running MPA API serves at once.
+
+The same amount of requests is sent to an endpoint with increasing client
+concurrency. With blocking handlers the throughput stays flat as concurrency
+grows, while handlers that offload their I/O scale with it::
+
+    python benchmarks/concurrency.py --url http://localhost:8080/pokemon/25
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def run(url: str, requests_count: int, concurrency: int) -> dict:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+
+    def timed_request(_) -> float:
+        start_time = time.perf_counter()
+        session.get(url)
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(timed_request, range(requests_count)))
+    elapsed_time = time.perf_counter() - start_time
+
+    return {
+        "concurrency": concurrency,
+        "throughput": requests_count / elapsed_time,
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1]
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--url", default="http://localhost:8080/pokemon/25")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+",
+                        default=[1, 8, 32, 64])
+    args = parser.parse_args()
+
+    print(f"{'concurrency':>11} {'req/s':>10} {'p50 (ms)':>10} "
+          f"{'p99 (ms)':>10}")
+    for concurrency in args.concurrency:
+        result = run(args.url, args.requests, concurrency)
+        print(f"{result['concurrency']:>11} {result['throughput']:>10.1f} "
+              f"{result['p50'] * 1000:>10.1f} {result['p99'] * 1000:>10.1f}")
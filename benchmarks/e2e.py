@@ -0,0 +1,378 @@
+"""End-to-end benchmark of the API, with local stand-ins for its services.
+
+The FastAPI app of `api/server.py` is served by uvicorn in process, against
+a local PokeAPI stub, the ``memory`` storage backend (or the Firestore
+emulator, with ``--backend firestore`` and ``FIRESTORE_EMULATOR_HOST`` set)
+and a fake Kafka producer that only counts messages. Each endpoint is loaded
+in turn by a fixed amount of concurrent clients, and the overhead added by
+`kafka_logging` is timed by calling each handler with and without it.
+
+Results can be saved as a baseline, and later runs fail when they regress
+beyond a threshold compared with it, or when there is no baseline::
+
+    python benchmarks/e2e.py --update-baseline
+    python benchmarks/e2e.py --threshold 0.2
+
+Requires ``httpx``, like `loadgen.py`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import timeit
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, ROOT)
+
+import httpx  # noqa: E402
+
+from loadgen import LatencyHistogram  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__),
+                                "e2e_baseline.json")
+LAST_POKEMON = 905
+
+
+class PokeAPIStub(BaseHTTPRequestHandler):
+    """Answer ``/api/v2/pokemon/{id}`` like the PokeAPI, after `latency`
+    seconds."""
+
+    latency = 0.0
+
+    def do_GET(self):
+        number = self.path.rstrip("/").rsplit("/", 1)[-1]
+        if self.latency:
+            time.sleep(self.latency)
+        if not number.isdigit() or not 1 <= int(number) <= LAST_POKEMON:
+            self.send_response(404)
+            self.end_headers()
+            self.wfile.write(b"Not Found")
+            return
+        body = json.dumps({
+            "id": int(number),
+            "name": f"pokemon-{number}",
+            "sprites": {"other": {"official-artwork": {
+                "front_default": f"https://example.com/{number}.png"}}}
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeProducer:
+    """In-process stand-in of `confluent_kafka.Producer`, which delivers
+    every message on the next poll without sending it anywhere."""
+
+    class Message:
+        def __init__(self, topic: str, value: bytes):
+            self._topic = topic
+            self._value = value
+
+        def topic(self):
+            return self._topic
+
+        def value(self):
+            return self._value
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def produce(self, topic, value=None, callback=None):
+        with self._lock:
+            self.messages += 1
+            self.bytes += len(value)
+            self._pending.append((callback, self.Message(topic, value)))
+
+    def poll(self, timeout=None):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for callback, message in pending:
+            if callback is not None:
+                callback(None, message)
+        if not pending and timeout:
+            time.sleep(timeout)
+        return len(pending)
+
+    def flush(self, timeout=None):
+        self.poll()
+        return 0
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_pokeapi_stub(latency: float) -> ThreadingHTTPServer:
+    PokeAPIStub.latency = latency
+    stub = ThreadingHTTPServer(("127.0.0.1", _free_port()), PokeAPIStub)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    return stub
+
+
+def start_api(port: int):
+    """Import the API, with the fake producer, and serve it with uvicorn
+    in a thread."""
+    import uvicorn
+
+    import kafka
+    import server
+
+    kafka._producer = FakeProducer()
+    kafka._poll_thread = threading.Thread(
+        target=kafka._poll_loop, name="kafka-poll", daemon=True)
+    kafka._poll_thread.start()
+
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port,
+                            log_level="warning")
+    api = uvicorn.Server(config)
+    thread = threading.Thread(target=api.run, daemon=True)
+    thread.start()
+    while not api.started:
+        if not thread.is_alive():
+            raise RuntimeError("The API failed to start.")
+        time.sleep(0.05)
+    return api, thread
+
+
+def scenarios(trainer: str, registered: list) -> dict:
+    """Requests sent to each endpoint, as functions returning the method,
+    path and JSON body of a request."""
+    return {
+        "/pokemon/{number}": lambda: (
+            "GET", f"/pokemon/{random.randint(1, LAST_POKEMON)}", None),
+        "/pokemon/random": lambda: ("GET", "/pokemon/random", None),
+        "/trainers/{trainer}": lambda: ("GET", f"/trainers/{trainer}", None),
+        "/trainers/{trainer}/pokemon": lambda: (
+            "GET", f"/trainers/{trainer}/pokemon", None),
+        "/trainers/{trainer}/pokemon [POST]": lambda: (
+            "POST", f"/trainers/{trainer}/pokemon",
+            {"id": random.randint(1, LAST_POKEMON),
+             "nickname": uuid.uuid4().hex, "level": 5}),
+        "/trainers/{trainer}/pokemon/{pokemon}/level": lambda: (
+            "POST",
+            f"/trainers/{trainer}/pokemon/{random.choice(registered)}/level",
+            {"levels": 1}),
+    }
+
+
+async def load_endpoint(client: httpx.AsyncClient, request, concurrency: int,
+                        duration: float, warmup: float) -> dict:
+    """Keep `concurrency` requests in flight for `warmup` plus `duration`
+    seconds, recording the latencies after the warm-up."""
+    histogram = LatencyHistogram()
+    errors = 0
+    start_time = time.perf_counter()
+    record_after = start_time + warmup
+    end_time = record_after + duration
+
+    async def client_loop():
+        nonlocal errors
+        while True:
+            request_start = time.perf_counter()
+            if request_start >= end_time:
+                return
+            method, path, body = request()
+            response = await client.request(method, path, json=body)
+            if request_start < record_after:
+                continue
+            if response.status_code >= 400:
+                errors += 1
+            histogram.record(time.perf_counter() - request_start)
+
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed_time = time.perf_counter() - record_after
+    summary = histogram.summary()
+    return {
+        "throughput_rps": histogram.count / elapsed_time,
+        "p50_ms": summary["p50_ms"],
+        "p99_ms": summary["p99_ms"],
+        "mean_ms": summary["mean_ms"],
+        "requests": histogram.count,
+        "errors": errors
+    }
+
+
+async def seed(client: httpx.AsyncClient, trainer: str) -> list:
+    """Register a trainer with a few pokemon, returning their names."""
+    response = await client.post(
+        "/trainers", json={"name": trainer, "image": "red.png"})
+    response.raise_for_status()
+    registered = []
+    for number in range(1, 11):
+        response = await client.post(
+            f"/trainers/{trainer}/pokemon",
+            json={"id": number, "nickname": f"pkmn{number}", "level": 5})
+        response.raise_for_status()
+        registered.append(response.json()["name"])
+    return registered
+
+
+def kafka_logging_overhead(trainer: str, registered: list,
+                           number: int) -> dict:
+    """Time each handler with and without `kafka_logging`, in microseconds
+    per call."""
+    import models
+    import server
+
+    # Header parameters default to FastAPI markers, so they are passed
+    # explicitly when calling the handlers directly.
+    calls = {
+        "/pokemon/{number}": (server.get_pokemon_from_number, (25,), {}),
+        "/trainers/{trainer}": (
+            server.get_trainer, (trainer,), {"if_none_match": None}),
+        "/trainers/{trainer}/pokemon": (
+            server.get_trainer_pokemon, (trainer,), {"if_none_match": None}),
+        "/trainers/{trainer}/pokemon/{pokemon}/level": (
+            server.level_up_pokemon,
+            (trainer, registered[0], models.Level(levels=0)), {}),
+    }
+    loop = asyncio.new_event_loop()
+    overhead = {}
+    for name, (handler, args, kwargs) in calls.items():
+        timings = []
+        for method in (handler.__wrapped__, handler):
+            loop.run_until_complete(method(*args, **kwargs))
+            timings.append(min(timeit.repeat(
+                lambda: loop.run_until_complete(method(*args, **kwargs)),
+                number=number, repeat=5)) / number * 1e6)
+        overhead[name] = {
+            "handler_us": timings[0],
+            "overhead_us": max(timings[1] - timings[0], 0.0)
+        }
+    loop.close()
+    return overhead
+
+
+async def run_endpoints(url: str, concurrency: int, duration: float,
+                        warmup: float) -> tuple:
+    trainer = f"bench-{uuid.uuid4().hex[:8]}"
+    limits = httpx.Limits(max_connections=concurrency,
+                          max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits,
+                                 timeout=30) as client:
+        registered = await seed(client, trainer)
+        results = {}
+        for name, request in scenarios(trainer, registered).items():
+            results[name] = await load_endpoint(
+                client, request, concurrency, duration, warmup)
+            print(f"{name:<46} {results[name]['throughput_rps']:>9.1f} "
+                  f"{results[name]['p50_ms']:>8.2f} "
+                  f"{results[name]['p99_ms']:>8.2f} "
+                  f"{results[name]['errors']:>7}")
+    return trainer, registered, results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Return a description of each metric worse than `baseline` by more
+    than `threshold`, as a fraction of the baseline value."""
+    regressions = []
+    checks = [("endpoints", "throughput_rps", -1), ("endpoints", "p50_ms", 1),
+              ("endpoints", "p99_ms", 1), ("kafka_logging", "overhead_us", 1)]
+    for section, metric, direction in checks:
+        for name, values in results[section].items():
+            old = baseline.get(section, {}).get(name, {}).get(metric)
+            if not old:
+                continue
+            change = (values[metric] - old) / old * direction
+            if change > threshold:
+                regressions.append(
+                    f"{name} {metric}: {old:.2f} -> {values[metric]:.2f} "
+                    f"({change:+.0%} worse)")
+    return regressions
+
+
+def main(args: argparse.Namespace) -> int:
+    if args.backend == "firestore" \
+            and not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("Set FIRESTORE_EMULATOR_HOST to benchmark the "
+                         "firestore backend against the emulator.")
+    stub = start_pokeapi_stub(args.pokeapi_latency / 1000)
+    os.environ["POKEAPI_URL"] = \
+        f"http://127.0.0.1:{stub.server_address[1]}/api/v2/pokemon"
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ.setdefault("FIRESTORE_PROJECT", "mpa-benchmark")
+    os.environ.pop("POKEDEX_PATH", None)
+    os.environ.pop("POKEAPI_CACHE_PATH", None)
+
+    port = _free_port()
+    api, thread = start_api(port)
+    try:
+        print(f"{'endpoint':<46} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'errors':>7}")
+        trainer, registered, endpoints = asyncio.run(run_endpoints(
+            f"http://127.0.0.1:{port}", args.concurrency, args.duration,
+            args.warmup))
+        overhead = kafka_logging_overhead(trainer, registered, args.number)
+    finally:
+        api.should_exit = True
+        thread.join()
+        stub.shutdown()
+
+    print(f"\n{'kafka_logging':<46} {'handler us':>10} {'overhead us':>11}")
+    for name, values in overhead.items():
+        print(f"{name:<46} {values['handler_us']:>10.1f} "
+              f"{values['overhead_us']:>11.1f}")
+    results = {"endpoints": endpoints, "kafka_logging": overhead}
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to '{args.baseline}'.")
+        return 0
+    if not os.path.exists(args.baseline):
+        # Timings depend on the machine, so no baseline is shipped, but a
+        # missing one must not pass the regression check.
+        print(f"\nNo baseline at '{args.baseline}', run with "
+              f"--update-baseline to create it.")
+        return 2
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.threshold)
+    if regressions:
+        print(f"\nRegressions beyond {args.threshold:.0%} of the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nNo regressions beyond {args.threshold:.0%} of the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--backend", choices=["memory", "firestore"],
+                        default="memory")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5,
+                        help="Seconds to load each endpoint for.")
+    parser.add_argument("--warmup", type=float, default=1,
+                        help="Seconds to load each endpoint before "
+                             "recording.")
+    parser.add_argument("--pokeapi-latency", type=float, default=0,
+                        help="Milliseconds the PokeAPI stub waits before "
+                             "answering.")
+    parser.add_argument("--number", type=int, default=500,
+                        help="Calls per timing of the kafka_logging "
+                             "overhead.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Tolerated regression, as a fraction of the "
+                             "baseline value.")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,77 @@
+"""Measure the per-request overhead of building a kafka_logging message.
+
+The message built for a `/trainers/{trainer}/pokemon` response is timed both
+the way it used to be built, parsing the response body back and serializing
+it twice, and with the current `kafka._encode_message`::
+
+    python benchmarks/kafka_logging.py --pokemon 100
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import kafka  # noqa: E402
+
+
+def trainer_pokemon_response(pokemon_count: int) -> JSONResponse:
+    pokemon = {
+        "id": 25,
+        "name": "pikachu",
+        "nickname": "pika",
+        "level": 5,
+        "caught_at": datetime.now().isoformat(),
+        "artwork": "https://raw.githubusercontent.com/PokeAPI/sprites/master/"
+                   "sprites/pokemon/other/official-artwork/25.png"
+    }
+    return JSONResponse({"name": "ash", "pokemon": [pokemon] * pokemon_count})
+
+
+def before(response: JSONResponse) -> bytes:
+    message = {
+        "endpoint": "/trainers/name/pokemon",
+        "request_type": "GET",
+        "response_status": response.status_code,
+        "response": json.loads(response.body.decode("utf-8")),
+        "start_time": datetime.now(),
+        "elapsed_time": 0.1
+    }
+    return json.dumps(jsonable_encoder(message)).encode("utf-8")
+
+
+def after(response: JSONResponse) -> bytes:
+    message = {
+        "endpoint": "/trainers/name/pokemon",
+        "request_type": "GET",
+        "response_status": response.status_code,
+        "start_time": datetime.now().isoformat(),
+        "elapsed_time": 0.1
+    }
+    return kafka._encode_message(message, response.body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--pokemon", type=int, nargs="+",
+                        default=[1, 100, 1000])
+    parser.add_argument("--number", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'pokemon':>8} {'before (us)':>12} {'after (us)':>12}")
+    for pokemon_count in args.pokemon:
+        response = trainer_pokemon_response(pokemon_count)
+        assert json.loads(before(response))["response"] == \
+            json.loads(after(response))["response"]
+        timings = [
+            timeit.timeit(lambda: build(response), number=args.number)
+            / args.number * 1e6
+            for build in (before, after)
+        ]
+        print(f"{pokemon_count:>8} {timings[0]:>12.1f} {timings[1]:>12.1f}")
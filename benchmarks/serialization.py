@@ -0,0 +1,115 @@
+"""Compare validated and fast serialization of a trainer's pokemon.
+
+A trainer with thousands of pokemon is registered on a storage backend, and
+the page of all of them is read, rendered and served by the
+`/trainers/{trainer}/pokemon` handler, both the default way, validating the
+stored data into models and encoding them with `jsonable_encoder`, and with
+``FAST_SERIALIZATION``, which skips the validation and encodes the models
+with orjson::
+
+    python benchmarks/serialization.py --pokemon 5000
+
+The handler is called without `kafka_logging`, with the trainer cache cleared
+before every call (``cold``) or already filled (``warm``).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+TRAINER = uuid4().hex
+
+
+def seed(pokemon_count: int):
+    import database as db
+    import models
+
+    db.store.register_trainer(TRAINER, "red.png")
+    pokemon = [
+        (models.RegisterPokemon(id=number, nickname=f"mon {number}",
+                                level=number % 100 + 1),
+         models.Pokemon(id=number, name=f"pokemon-{number}",
+                        artwork=f"https://img.pokemondb.net/{number}.png"))
+        for number in range(1, pokemon_count + 1)
+    ]
+    db.store.register_pokemon_batch(TRAINER, pokemon)
+
+
+def median_ms(func, iterations: int, setup=None) -> float:
+    timings = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return statistics.median(timings) * 1e3
+
+
+def run(pokemon_count: int, iterations: int) -> dict:
+    import database as db
+    import server
+    from responses import model_response
+    from storage import PokemonQuery
+
+    query = PokemonQuery(pokemon_count)
+    page = db.store.get_trainer_pokemon_page(TRAINER, query)
+    handler = server.get_trainer_pokemon.__wrapped__
+
+    def serve():
+        return asyncio.run(
+            handler(TRAINER, limit=pokemon_count, if_none_match=None))
+
+    def clear_cache():
+        db.trainer_cache.invalidate(TRAINER)
+
+    serve()
+    return {
+        "read": median_ms(
+            lambda: db.store.get_trainer_pokemon_page(TRAINER, query),
+            iterations),
+        "render": median_ms(
+            lambda: model_response(page, exclude_unset=True), iterations),
+        "handler (cold)": median_ms(serve, iterations, setup=clear_cache),
+        "handler (warm)": median_ms(serve, iterations),
+        "body": serve().body
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--pokemon", type=int, default=5000)
+    parser.add_argument("--backend", default="memory",
+                        choices=["firestore", "memory", "sqlite"])
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    # The page holds every pokemon of the trainer.
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ["POKEMON_MAX_PAGE_SIZE"] = str(args.pokemon)
+    os.environ.setdefault(
+        "SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "mpa.db"))
+    import models
+
+    seed(args.pokemon)
+    results = {}
+    for fast in (False, True):
+        models.FAST_SERIALIZATION = fast
+        results[fast] = run(args.pokemon, args.iterations)
+    assert json.loads(results[False].pop("body")) == \
+        json.loads(results[True].pop("body"))
+
+    print(f"{args.pokemon} pokemon on the {args.backend} backend")
+    print(f"{'stage':<16} {'validated (ms)':>15} {'fast (ms)':>10} "
+          f"{'speedup':>8}")
+    for stage, validated in results[False].items():
+        fast = results[True][stage]
+        print(f"{stage:<16} {validated:>15.2f} {fast:>10.2f} "
+              f"{validated / fast:>7.1f}x")
@@ -0,0 +1,74 @@
+"""Compare the latency of the trainer store backends head to head.
+
+Every operation of the storage interface is timed directly against each
+backend, without going through the API::
+
+    python benchmarks/storage.py --backends memory sqlite
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+import models  # noqa: E402
+import storage  # noqa: E402
+
+PIKACHU = models.Pokemon(id=25, name="pikachu", artwork="")
+
+
+def timed(func, *args) -> float:
+    start_time = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start_time
+
+
+def run(store: storage.TrainerStore, iterations: int) -> dict:
+    trainer = uuid4().hex
+    pokemon = models.RegisterPokemon(id=PIKACHU.id, nickname="pika")
+    latencies = {
+        "register_trainer": [timed(store.register_trainer, trainer, "")],
+        "register_pokemon": [],
+        "level_up_pokemon": [],
+        "get_trainer": [],
+        "get_trainer_pokemon_page": []
+    }
+    query = storage.PokemonQuery(100)
+    for _ in range(iterations):
+        latencies["register_pokemon"].append(
+            timed(store.register_pokemon, trainer, pokemon, PIKACHU))
+        latencies["level_up_pokemon"].append(
+            timed(store.level_up_pokemon, trainer, PIKACHU.name, 1))
+        latencies["get_trainer"].append(timed(store.get_trainer, trainer))
+        latencies["get_trainer_pokemon_page"].append(
+            timed(store.get_trainer_pokemon_page, trainer, query))
+    return {
+        operation: statistics.median(values)
+        for operation, values in latencies.items()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite"],
+                        choices=["firestore", "memory", "sqlite"])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.setdefault("SQLITE_PATH", os.path.join(directory, "mpa.db"))
+        results = {
+            backend: run(storage.get_backend(backend), args.iterations)
+            for backend in args.backends
+        }
+
+    print(f"{'operation':<26}" + "".join(
+        f"{backend + ' (ms)':>16}" for backend in results))
+    for operation in next(iter(results.values())):
+        print(f"{operation:<26}" + "".join(
+            f"{result[operation] * 1000:>16.3f}"
+            for result in results.values()))
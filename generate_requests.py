@@ -56,43 +56,44 @@ configuration = {
 }
 
 
-def register_pokemon(id_: int, url: str) -> dict:
-    body = {
+def register_pokemon_body(id_: int) -> dict:
+    return {
         "id": id_,
         "nickname": uuid4().hex,
         "level": random.randrange(1, 60)
     }
-    response = requests.post(url, json=body)
-    return response
 
 
-def level_pokemon(url: str) -> dict:
-    body = {
+def level_pokemon_body() -> dict:
+    return {
         "levels": random.randrange(-2, 3)
     }
-    response = requests.post(url, json=body)
-    return response
+
+
+def build_request(request_setup: dict) -> tuple:
+    """Pick a random request for the given entry of `configuration`.
+
+    Returns
+    -------
+    tuple
+        HTTP method, path and JSON body (or None) of the request.
+    """
+    ids = request_setup["ids"]
+    id_ = random.choice(ids) if ids is not None else None
+    path = request_setup["endpoint"].format(id=id_)
+    if request_setup["type"] == "GET":
+        return "GET", path, None
+    if request_setup["endpoint"] == "/trainers/bob/pokemon":
+        return "POST", path, register_pokemon_body(id_)
+    return "POST", path, level_pokemon_body()
 
 
 def run():
     request_setup = configuration[random.choice(list(configuration.keys()))]
-    if request_setup["type"] == "GET":
-        if request_setup["ids"] is not None:
-            id_ = random.choice(request_setup["ids"])
-            url = request_setup["endpoint"].format(id=id_)
-        else:
-            url = request_setup["endpoint"]
-        url = endpoint + url
-        response = requests.get(url)
-    else:
-        id_ = random.choice(request_setup["ids"])
-        if request_setup["endpoint"] == "/trainers/bob/pokemon":
-            url = endpoint + request_setup["endpoint"]
-            response = register_pokemon(id_, url)
-        elif "/pokemon/{id}/level" in request_setup["endpoint"]:
-            url = endpoint + request_setup["endpoint"].format(id=id_)
-            response = level_pokemon(url)
-    print(request_setup["type"])
+    method, path, body = build_request(request_setup)
+    url = endpoint + path
+    response = requests.request(method, url, json=body)
+    print(method)
     print(url)
     print(response.json())
 
@@ -0,0 +1,279 @@
+"""Load generator for the MPA API, built on `generate_requests.configuration`.
+
+Requests are sent concurrently over a pool of keep-alive connections, in one
+of two modes:
+
+- ``open``: requests start at a constant rate, whether or not previous ones
+  finished. Latency is measured from the scheduled start, so a slow server
+  is not hidden by the generator waiting on it.
+- ``closed``: a fixed amount of clients each send a request as soon as their
+  previous one finished.
+
+Requires `httpx <https://www.python-httpx.org/>`_::
+
+    python loadgen.py --mode open --rate 200 --duration 60 --warmup 10
+    python loadgen.py --mode closed --concurrency 32 --mix pokemon=3 trainers=1
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Dict, List
+
+import httpx
+
+from generate_requests import build_request, configuration, endpoint
+
+
+class LatencyHistogram:
+    """Log-linear histogram of latencies, in the style of HdrHistogram.
+
+    Latencies are recorded in microseconds, in buckets whose width grows
+    with their value, keeping about two significant digits of precision
+    from 1 microsecond to hours, in a small and bounded amount of memory.
+    """
+
+    SUB_BUCKETS = 64
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds: float):
+        value = max(int(seconds * 1e6), 0)
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percentile: float) -> float:
+        """Return the given percentile, in milliseconds."""
+        rank = percentile / 100 * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                # Highest value of the bucket, as reported by HdrHistogram.
+                return min(self._value(index + 1) - 1, self.max) / 1000
+        return self.max / 1000
+
+    def _index(self, value: int) -> int:
+        if value < 2 * self.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - self.SUB_BUCKETS.bit_length()
+        return (shift + 1) * self.SUB_BUCKETS + (value >> shift) \
+            - self.SUB_BUCKETS
+
+    def _value(self, index: int) -> int:
+        if index < 2 * self.SUB_BUCKETS:
+            return index
+        shift = index // self.SUB_BUCKETS - 1
+        return (index % self.SUB_BUCKETS + self.SUB_BUCKETS) << shift
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count / 1000 if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "p999_ms": self.percentile(99.9),
+            "max_ms": self.max / 1000
+        }
+
+
+class Report:
+    """Latencies, status codes and errors of the requests, per endpoint."""
+
+    def __init__(self):
+        self.latencies: Dict[str, LatencyHistogram] = {}
+        self.statuses: Dict[str, Counter] = {}
+        self.errors: Dict[str, Counter] = {}
+        self.start_time = None
+        self.end_time = None
+
+    def record(self, name: str, latency: float, status: int = None,
+               error: Exception = None):
+        if name not in self.latencies:
+            self.latencies[name] = LatencyHistogram()
+            self.statuses[name] = Counter()
+            self.errors[name] = Counter()
+        if error is not None:
+            self.errors[name][type(error).__name__] += 1
+            return
+        self.latencies[name].record(latency)
+        self.statuses[name][str(status)] += 1
+
+    def to_dict(self) -> dict:
+        elapsed_time = self.end_time - self.start_time
+        total = sum(h.count for h in self.latencies.values())
+        return {
+            "duration_s": elapsed_time,
+            "requests": total,
+            "throughput_rps": total / elapsed_time,
+            "errors": sum(sum(c.values()) for c in self.errors.values()),
+            "endpoints": {
+                name: {
+                    **self.latencies[name].summary(),
+                    "throughput_rps": self.latencies[name].count
+                    / elapsed_time,
+                    "statuses": dict(self.statuses[name]),
+                    "errors": dict(self.errors[name])
+                }
+                for name in sorted(self.latencies)
+            }
+        }
+
+
+class LoadGenerator:
+    """Send a weighted mix of the requests in `configuration`.
+
+    Parameters
+    ----------
+    client : httpx.AsyncClient
+        Client pooling the connections to the API.
+    mix : dict
+        Weight of each entry of `configuration`.
+    warmup : float
+        Seconds during which results are not recorded.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, mix: Dict[str, float],
+                 warmup: float):
+        self.client = client
+        self.names: List[str] = list(mix)
+        self.weights: List[float] = list(mix.values())
+        self.warmup = warmup
+        self.report = Report()
+        self._record_after = None
+
+    async def send(self, scheduled_time: float = None):
+        name = random.choices(self.names, self.weights)[0]
+        method, path, body = build_request(configuration[name])
+        start_time = scheduled_time or time.perf_counter()
+        status = error = None
+        try:
+            response = await self.client.request(method, path, json=body)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            error = e
+        if start_time >= self._record_after:
+            self.report.record(
+                name, time.perf_counter() - start_time, status, error)
+
+    def _start(self, duration: float) -> float:
+        now = time.perf_counter()
+        self._record_after = now + self.warmup
+        return now + self.warmup + duration
+
+    def _finish(self, end_time: float):
+        self.report.start_time = self._record_after
+        self.report.end_time = max(time.perf_counter(), end_time)
+
+    async def run_open(self, rate: float, duration: float):
+        """Start `rate` requests per second for `duration` seconds."""
+        end_time = self._start(duration)
+        start_time = time.perf_counter()
+        tasks = set()
+        sent = 0
+        while True:
+            scheduled_time = start_time + sent / rate
+            if scheduled_time >= end_time:
+                break
+            delay = scheduled_time - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(self.send(scheduled_time))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+        await asyncio.gather(*tasks)
+        self._finish(end_time)
+
+    async def run_closed(self, concurrency: int, duration: float):
+        """Keep `concurrency` requests in flight for `duration` seconds."""
+        end_time = self._start(duration)
+
+        async def client_loop():
+            while time.perf_counter() < end_time:
+                await self.send()
+
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        self._finish(end_time)
+
+
+def print_report(report: dict):
+    print(f"{report['requests']} requests in {report['duration_s']:.1f}s - "
+          f"{report['throughput_rps']:.1f} req/s, {report['errors']} errors")
+    print(f"{'endpoint':<20} {'req/s':>8} {'mean':>8} {'p50':>8} {'p90':>8} "
+          f"{'p99':>8} {'p99.9':>8} {'max':>8}  statuses")
+    for name, stats in report["endpoints"].items():
+        if not stats["count"]:
+            print(f"{name:<20} {'-':>8}  errors: {stats['errors']}")
+            continue
+        print(f"{name:<20} {stats['throughput_rps']:>8.1f} "
+              + " ".join(f"{stats[key]:>8.1f}" for key in (
+                  "mean_ms", "p50_ms", "p90_ms", "p99_ms", "p999_ms",
+                  "max_ms"))
+              + f"  {stats['statuses']}")
+    print("Latencies in milliseconds.")
+
+
+def parse_mix(values: List[str]) -> Dict[str, float]:
+    if not values:
+        return {name: 1.0 for name in configuration}
+    mix = {}
+    for value in values:
+        name, _, weight = value.partition("=")
+        if name not in configuration:
+            raise SystemExit(f"Unknown request '{name}', expected one of "
+                             f"{sorted(configuration)}.")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def main(args: argparse.Namespace) -> dict:
+    limits = httpx.Limits(max_connections=args.connections,
+                          max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits,
+                                 timeout=args.timeout) as client:
+        generator = LoadGenerator(client, parse_mix(args.mix), args.warmup)
+        if args.mode == "open":
+            await generator.run_open(args.rate, args.duration)
+        else:
+            await generator.run_closed(args.concurrency, args.duration)
+    return generator.report.to_dict()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--url", default=endpoint)
+    parser.add_argument("--mode", choices=["open", "closed"], default="open")
+    parser.add_argument("--rate", type=float, default=100,
+                        help="Requests per second, in open mode.")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="Concurrent clients, in closed mode.")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="Seconds to record results for.")
+    parser.add_argument("--warmup", type=float, default=5,
+                        help="Seconds to send requests before recording.")
+    parser.add_argument("--mix", nargs="+", metavar="NAME=WEIGHT",
+                        help="Weights of the requests in the configuration "
+                             "of generate_requests.py. Defaults to equal "
+                             "weights.")
+    parser.add_argument("--connections", type=int, default=100,
+                        help="Size of the connection pool.")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--json", metavar="PATH",
+                        help="Write the report as JSON to this file.")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
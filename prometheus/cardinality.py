@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from prometheus_client import Counter, Gauge
+
+OVERFLOW_VALUE = "other"
+
+metric_series = Gauge(
+    "mpa_exporter_metric_series",
+    "Label series currently tracked for a cardinality limited metric",
+    ["metric"],
+    multiprocess_mode="livesum")
+
+metric_overflows = Counter(
+    "mpa_exporter_metric_overflows_total",
+    "Updates of a cardinality limited metric sent to its overflow series, "
+    "or dropped",
+    ["metric"])
+
+metric_evictions = Counter(
+    "mpa_exporter_metric_evictions_total",
+    "Idle label series removed from a cardinality limited metric",
+    ["metric"])
+
+
+class CardinalityLimiter:
+    """Bound the amount of label series of a metric.
+
+    New label series are accepted until `max_series` is reached. After
+    that, updates to new series go to an overflow series, where the values
+    of `overflow_labels` are replaced with ``other``. Gauges have no
+    overflow series, since the last value set by unrelated series means
+    nothing, and their updates to new series are dropped instead. Series not
+    updated for `ttl` seconds are removed from the metric, making room for
+    new ones.
+
+    With several workers, removed series are still exported by the files of
+    the multiprocess mode until the worker restarts, so only the limit on
+    new series applies.
+
+    Parameters
+    ----------
+    metric : prometheus_client.metrics.MetricWrapperBase
+        Labelled metric to limit.
+    max_series : int, optional
+        Maximum amount of label series. Defaults to the
+        ``METRIC_MAX_SERIES`` environment variable, or 1000.
+    ttl : float, optional
+        Seconds after which an idle series is removed. Defaults to the
+        ``METRIC_SERIES_TTL`` environment variable, or 3600.
+    overflow_labels : iterable of str, optional
+        Labels replaced in the overflow series. Defaults to all labels.
+    """
+
+    def __init__(self, metric, max_series: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 overflow_labels: Optional[Iterable[str]] = None):
+        self.metric = metric
+        self.max_series = max_series or int(
+            os.environ.get("METRIC_MAX_SERIES", 1000))
+        self.ttl = ttl or float(os.environ.get("METRIC_SERIES_TTL", 3600))
+        self.labelnames = list(metric._labelnames)
+        overflow_labels = set(overflow_labels or self.labelnames)
+        self._overflow_positions = [
+            i for i, name in enumerate(self.labelnames)
+            if name in overflow_labels
+        ]
+        self._last_update: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        name = metric._name
+        self._series = metric_series.labels(metric=name)
+        self._overflows = metric_overflows.labels(metric=name)
+        self._evictions = metric_evictions.labels(metric=name)
+        self._drop_overflows = metric._type == "gauge"
+
+    def labels(self, *labelvalues, **labelkwargs):
+        """Return the child of the given labels, or its overflow series,
+        which for gauges ignores every update."""
+        if labelkwargs:
+            labelvalues = [labelkwargs[name] for name in self.labelnames]
+        key = tuple(str(value) for value in labelvalues)
+        now = time.monotonic()
+        with self._lock:
+            if key in self._last_update:
+                self._last_update[key] = now
+                self._last_update.move_to_end(key)
+            else:
+                self._evict_idle(now)
+                if len(self._last_update) >= self.max_series:
+                    self._overflows.inc()
+                    if self._drop_overflows:
+                        return _DROPPED
+                    return self.metric.labels(*self._overflow_key(key))
+                self._last_update[key] = now
+                self._series.set(len(self._last_update))
+        return self.metric.labels(*key)
+
+    def _overflow_key(self, key: tuple) -> tuple:
+        key = list(key)
+        for position in self._overflow_positions:
+            key[position] = OVERFLOW_VALUE
+        return tuple(key)
+
+    def _evict_idle(self, now: float):
+        # Series are kept in order of last update, so only the oldest ones
+        # need to be checked.
+        while self._last_update:
+            key, last_update = next(iter(self._last_update.items()))
+            if now - last_update < self.ttl:
+                break
+            del self._last_update[key]
+            self.metric.remove(*key)
+            self._evictions.inc()
+        self._series.set(len(self._last_update))
+
+
+class _DroppedSeries:
+    """Child of a metric that ignores its updates."""
+
+    def set(self, value: float):
+        pass
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def dec(self, amount: float = 1):
+        pass
+
+
+_DROPPED = _DroppedSeries()
@@ -0,0 +1,42 @@
+"""Decoding of the events published by the API to Kafka, shared by the
+metrics server and the other consumers of the topics."""
+import json
+from datetime import datetime
+from typing import Optional
+
+import msgpack
+
+# Compact events published by the API start with this header, followed by a
+# MessagePack array of EVENT_FIELDS. Any other message is parsed as JSON.
+EVENT_MAGIC = b"MPA"
+EVENT_FIELDS = {
+    1: ("endpoint", "request_type", "response_status", "start_time",
+        "elapsed_time", "response"),
+    2: ("endpoint", "request_type", "response_status", "start_time",
+        "elapsed_time", "response", "phases")
+}
+
+
+def decode_message(value: bytes) -> dict:
+    if value[:3] == EVENT_MAGIC:
+        fields = EVENT_FIELDS.get(value[3])
+        if fields is None:
+            raise ValueError(f"Unknown event schema version {value[3]}.")
+        return dict(zip(fields, msgpack.unpackb(value[4:])))
+    return json.loads(value)
+
+
+def event_time(message: dict) -> Optional[float]:
+    """Time at which the request of an event started, in seconds since the
+    epoch, or None if the event does not have it."""
+    start_time = message.get("start_time")
+    if start_time is None:
+        return None
+    # JSON events carry an ISO timestamp, MessagePack events a number.
+    if isinstance(start_time, str):
+        return datetime.fromisoformat(start_time).timestamp()
+    return float(start_time)
+
+
+def format_partitions(partitions) -> list:
+    return [f"{p.topic}[{p.partition}]" for p in partitions]
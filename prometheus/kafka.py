@@ -1,15 +1,23 @@
-import json
+import glob
+import multiprocessing
 import os
+import signal
+import sys
 import time
 import logging
+from collections import Counter as LabelCounter
 
-from confluent_kafka import Consumer, KafkaException
-from prometheus_client import start_http_server, Counter, Gauge
-
-from metric_handlers import (
-    pokemon__random, trainers__name__pokemon__name__level__register
+from confluent_kafka import Consumer, KafkaException, TopicPartition
+from prometheus_client import (
+    start_http_server, CollectorRegistry, Counter, Gauge, Histogram,
+    REGISTRY, multiprocess
 )
 
+import metric_handlers
+from events import decode_message, event_time, format_partitions
+from sketch import QuantileCollector
+from windows import WindowedAggregator
+
 # Logging setup
 logger = logging.getLogger(__name__)
 formatter = logging.Formatter(
@@ -26,17 +34,120 @@ with open(topics_path) as f:
     topics_file = f.read()
 topics: list = topics_file.strip().split("\n")
 
+# Consumer setup. In "batch" mode, messages are consumed, decoded and
+# aggregated in batches of up to CONSUMER_BATCH_SIZE, and offsets are
+# committed once per batch.
+consumer_mode = os.environ.get("CONSUMER_MODE", "single")
+batch_size = int(os.environ.get("CONSUMER_BATCH_SIZE", 500))
+batch_timeout = float(os.environ.get("CONSUMER_BATCH_TIMEOUT", 1.0))
+group_id = os.environ.get("CONSUMER_GROUP_ID", "test")
+
+# With more than one worker, a supervisor process forks the workers into the
+# same consumer group and serves their merged metrics. This requires the
+# PROMETHEUS_MULTIPROC_DIR environment variable to point to a directory
+# shared by all of them. Gauges use "mostrecent" so the merged value is the
+# last one set by any worker.
+workers = int(os.environ.get("CONSUMER_WORKERS", 1))
+
 counter = Counter(
     "mpa_requests_total",
     "Request count for the MPA API",
     ["endpoint", "request_type", "status_code"])
 
-gauge = Gauge(
-    "mpa_request_response_time",
+# Response time buckets, in seconds, as a comma separated list.
+response_time_buckets = [
+    float(bucket) for bucket in os.environ.get(
+        "RESPONSE_TIME_BUCKETS",
+        "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+    ).split(",")
+]
+
+response_time = Histogram(
+    "mpa_request_response_time_seconds",
     "Response time for endpoints on the MPA API",
-    ["endpoint", "request_type", "status_code"]
+    ["endpoint", "request_type", "status_code"],
+    buckets=response_time_buckets
+)
+
+# Optional streaming sketch with accurate response time quantiles. Its
+# quantiles cannot be merged across processes, so it is only available with
+# a single worker.
+quantile_sketch = None
+if os.environ.get("QUANTILE_SKETCH", "false").lower() == "true":
+    if workers > 1:
+        logger.warning("QUANTILE_SKETCH is not supported with more than one "
+                       "worker and was disabled.")
+    else:
+        quantile_sketch = QuantileCollector(
+            "mpa_request_response_time_quantile",
+            "Response time quantiles for endpoints on the MPA API",
+            ["endpoint", "request_type", "status_code"],
+            relative_accuracy=float(
+                os.environ.get("QUANTILE_SKETCH_ACCURACY", 0.01)),
+            window=float(os.environ.get("QUANTILE_SKETCH_WINDOW", 600))
+        )
+        REGISTRY.register(quantile_sketch)
+
+# Per-endpoint request rates, error ratios and latency quantiles over
+# sliding windows, pre-aggregated in process. Like the quantile sketch, it
+# is only available with a single worker.
+windowed_aggregator = None
+if os.environ.get("WINDOWED_AGGREGATION", "true").lower() == "true":
+    if workers > 1:
+        logger.warning("WINDOWED_AGGREGATION is not supported with more "
+                       "than one worker and was disabled.")
+    else:
+        windowed_aggregator = WindowedAggregator(
+            windows=[
+                float(window) for window in os.environ.get(
+                    "AGGREGATION_WINDOWS", "60,300").split(",")
+            ],
+            slot_seconds=float(
+                os.environ.get("AGGREGATION_SLOT_SECONDS", 5))
+        )
+        REGISTRY.register(windowed_aggregator)
+
+consumed_messages = Counter(
+    "mpa_exporter_messages_total",
+    "Messages consumed by the metrics exporter",
+    ["topic"])
+
+consumer_lag = Gauge(
+    "mpa_exporter_consumer_lag",
+    "Messages behind the end of each partition after the last batch",
+    ["topic", "partition"],
+    multiprocess_mode="mostrecent")
+
+consumer_throughput = Gauge(
+    "mpa_exporter_throughput",
+    "Messages consumed per second over the last batch",
+    multiprocess_mode="livesum")
+
+batch_size_histogram = Histogram(
+    "mpa_exporter_batch_size",
+    "Amount of messages per consumed batch",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 5000))
+
+# Seconds spent in each phase of a request, as traced by the API. The
+# "other" phase is the part of the response time outside of any traced
+# phase, e.g. validation and rendering.
+phase_duration = Histogram(
+    "mpa_request_phase_duration_seconds",
+    "Time spent in each phase of the requests to the MPA API",
+    ["endpoint", "phase"],
+    buckets=response_time_buckets
 )
 
+batch_duration = Histogram(
+    "mpa_exporter_batch_duration_seconds",
+    "Time to decode and handle a consumed batch")
+
+
+# Metric handlers of each endpoint, discovered from the metric_handlers
+# package.
+handlers = metric_handlers.discover()
+logger.info(f"Metric handlers - {sorted(handlers)}")
+
 
 def handle_message(message: dict):
     endpoint = message["endpoint"]
@@ -44,19 +155,92 @@ def handle_message(message: dict):
     status = message["response_status"]
     counter.labels(endpoint=endpoint, request_type=request_type,
                    status_code=status).inc()
-    gauge.labels(
+    response_time.labels(
         endpoint=endpoint, request_type=request_type,
-        status_code=status).set(message["elapsed_time"])
+        status_code=status).observe(message["elapsed_time"])
+    if quantile_sketch is not None:
+        quantile_sketch.add((endpoint, request_type, status),
+                            (message["elapsed_time"],))
+    if windowed_aggregator is not None:
+        windowed_aggregator.add(endpoint, status, message["elapsed_time"],
+                                event_time(message))
+    for phase, seconds in _phases(message):
+        phase_duration.labels(endpoint=endpoint, phase=phase).observe(seconds)
+    _handle_endpoint(message)
+
+
+def handle_batch(messages: list):
+    """Handle a batch of messages, updating each metric series once."""
+    elapsed_times = {}
+    phase_times = {}
+    for message in messages:
+        labels = (message["endpoint"], message["request_type"],
+                  message["response_status"])
+        elapsed_times.setdefault(labels, []).append(message["elapsed_time"])
+        if windowed_aggregator is not None:
+            windowed_aggregator.add(labels[0], labels[2],
+                                    message["elapsed_time"],
+                                    event_time(message))
+        for phase, seconds in _phases(message):
+            phase_times.setdefault(
+                (message["endpoint"], phase), []).append(seconds)
+        _handle_endpoint(message)
+
+    for labels, values in phase_times.items():
+        child = phase_duration.labels(*labels)
+        for value in values:
+            child.observe(value)
+
+    for labels, values in elapsed_times.items():
+        counter.labels(*labels).inc(len(values))
+        child = response_time.labels(*labels)
+        for value in values:
+            child.observe(value)
+        if quantile_sketch is not None:
+            quantile_sketch.add(labels, values)
+
+
+def _phases(message: dict) -> list:
+    """Return the traced phases of a message, including "other"."""
+    phases = message.get("phases")
+    if not phases:
+        return []
+    # The "event_content" phase, named "kafka" by older versions of the API,
+    # happens after the response time is measured.
+    traced = sum(seconds for phase, seconds in phases.items()
+                 if phase not in ("event_content", "kafka"))
+    return list(phases.items()) + [
+        ("other", max(message["elapsed_time"] - traced, 0.0))]
+
+
+def _handle_endpoint(message: dict):
+    for handler in handlers.get(message["endpoint"], ()):
+        handler(message)
+
+
+def _on_assign(consumer, partitions):
+    logger.info(f"Assigned partitions - {format_partitions(partitions)}")
+
+
+def _on_revoke(consumer, partitions):
+    logger.info(f"Revoked partitions - {format_partitions(partitions)}")
+    if consumer_mode == "batch":
+        # Offsets are committed per batch, so commit what was already
+        # handled before the partitions move to another worker.
+        try:
+            consumer.commit(asynchronous=False)
+        except KafkaException as e:
+            logger.warning(f"Failed to commit revoked partitions - {e}")
+
 
-    if endpoint == "/pokemon/random":
-        pokemon__random.handler(message)
-    if endpoint == "/trainers/name/pokemon/name/level/register":
-        trainers__name__pokemon__name__level__register.handler(message)
+def _subscribe(consumer, topics):
+    consumer.subscribe(topics, on_assign=_on_assign, on_revoke=_on_revoke,
+                       on_lost=_on_revoke)
 
 
 def consumer_loop(consumer, topics):
     try:
-        consumer.subscribe(topics)
+        _subscribe(consumer, topics)
 
         while True:
             msg = consumer.poll(timeout=1.0)
@@ -66,35 +250,143 @@ def consumer_loop(consumer, topics):
             if msg.error():
                 raise KafkaException(msg.error())
             else:
-                value = json.loads(msg.value().decode("utf-8"))
-                logger.info(f'{msg.topic()} - {value}')
+                value = decode_message(msg.value())
+                logger.debug(f'{msg.topic()} - {value}')
                 handle_message(value)
+                consumed_messages.labels(topic=msg.topic()).inc()
+    finally:
+        consumer.close()
+
+
+def batch_consumer_loop(consumer, topics):
+    try:
+        _subscribe(consumer, topics)
+
+        last_batch_time = time.perf_counter()
+        while True:
+            msgs = consumer.consume(num_messages=batch_size,
+                                    timeout=batch_timeout)
+            if not msgs:
+                continue
+
+            start_time = time.perf_counter()
+            values = []
+            last_offsets = {}
+            topic_counts = LabelCounter()
+            for msg in msgs:
+                if msg.error():
+                    raise KafkaException(msg.error())
+                values.append(decode_message(msg.value()))
+                last_offsets[(msg.topic(), msg.partition())] = msg.offset()
+                topic_counts[msg.topic()] += 1
+            handle_batch(values)
+            consumer.commit(asynchronous=True)
+
+            end_time = time.perf_counter()
+            batch_duration.observe(end_time - start_time)
+            batch_size_histogram.observe(len(msgs))
+            consumer_throughput.set(len(msgs) / (end_time - last_batch_time))
+            last_batch_time = end_time
+            for topic, count in topic_counts.items():
+                consumed_messages.labels(topic=topic).inc(count)
+            _update_lag(consumer, last_offsets)
     finally:
         consumer.close()
 
 
+def _update_lag(consumer, last_offsets: dict):
+    for (topic, partition), offset in last_offsets.items():
+        # The cached high watermark is refreshed on every fetch, so this
+        # does not query the broker.
+        _, high = consumer.get_watermark_offsets(
+            TopicPartition(topic, partition), cached=True)
+        if high >= 0:
+            consumer_lag.labels(topic=topic, partition=partition).set(
+                max(high - offset - 1, 0))
+
+
 def _setup_consumer():
     kafka_endpoint = os.environ.get("KAFKA_ENDPOINT", "localhost:19092")
     conf = {'bootstrap.servers': kafka_endpoint,
-            'group.id': "test",
-            'auto.offset.reset': 'smallest'}
+            'group.id': group_id,
+            'auto.offset.reset': 'smallest',
+            'enable.auto.commit': consumer_mode != "batch"}
     consumer = Consumer(conf)
 
     return consumer
 
 
-if __name__ == "__main__":
-    start_http_server(8000)
+def run_worker():
+    # Leave the consumer group cleanly on SIGTERM, so that the partitions
+    # of this worker are reassigned right away.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.default_int_handler)
 
     retries = 0
     while True:
         try:
             consumer = _setup_consumer()
             logger.info(f"Listening to topics - {topics}")
-            consumer_loop(consumer, topics)
+            if consumer_mode == "batch":
+                batch_consumer_loop(consumer, topics)
+            else:
+                consumer_loop(consumer, topics)
         except Exception as e:
             logger.error(str(e))
             retries = retries + 1
             if retries > 5:
                 break
             time.sleep(30)
+
+
+def run_supervisor(workers: int):
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir is None:
+        raise RuntimeError(
+            "PROMETHEUS_MULTIPROC_DIR must be set to run multiple workers.")
+    # Values of previous runs would be merged into the new ones.
+    for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+        if not path.endswith(f"_{os.getpid()}.db"):
+            os.remove(path)
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(8000, registry=registry)
+
+    processes = {}
+
+    def start_worker(index: int):
+        process = multiprocessing.Process(
+            target=run_worker, name=f"consumer-{index}")
+        process.start()
+        processes[index] = process
+        logger.info(f"Started worker {index} - pid {process.pid}")
+
+    def stop_workers(*_):
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+
+    for index in range(workers):
+        start_worker(index)
+    while True:
+        time.sleep(5)
+        for index, process in list(processes.items()):
+            if not process.is_alive():
+                logger.error(f"Worker {index} exited with code "
+                             f"{process.exitcode}, restarting it.")
+                multiprocess.mark_process_dead(process.pid)
+                start_worker(index)
+
+
+if __name__ == "__main__":
+    if workers > 1:
+        run_supervisor(workers)
+    else:
+        start_http_server(8000)
+        run_worker()
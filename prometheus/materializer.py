@@ -0,0 +1,310 @@
+"""Materialize statistics of each trainer from the Kafka topics.
+
+Registrations and level ups of pokemon published by the API are applied
+incrementally to a SQLite database, from which the API serves the
+``/trainers/{trainer}/stats`` and ``/leaderboard`` endpoints without scanning
+the pokemon of any trainer::
+
+    TRAINER_STATS_PATH=trainer_stats.db python materializer.py
+
+The offsets of the consumed messages are stored in the same transaction as
+the statistics they update, and consumption resumes from them, so each
+message is applied exactly once, even across restarts.
+"""
+import logging
+import os
+import signal
+import sqlite3
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from confluent_kafka import Consumer, KafkaException
+
+from events import decode_message, event_time, format_partitions
+
+logger = logging.getLogger(__name__)
+formatter = logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)-8s - %(message)s"
+)
+handler = logging.StreamHandler()
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+logger.setLevel("INFO")
+
+REGISTER_TOPIC = "TRAINERS__NAME__POKEMON__REGISTER"
+BATCH_TOPIC = "TRAINERS__NAME__POKEMON__BATCH__REGISTER"
+LEVEL_TOPIC = "TRAINERS__NAME__POKEMON__NAME__LEVEL__REGISTER"
+TOPICS = [REGISTER_TOPIC, BATCH_TOPIC, LEVEL_TOPIC]
+
+stats_path = os.environ.get("TRAINER_STATS_PATH", "trainer_stats.db")
+group_id = os.environ.get("MATERIALIZER_GROUP_ID", "mpa-materializer")
+# Messages are consumed and applied in batches, like the "batch" mode of the
+# metrics server.
+batch_size = int(os.environ.get("CONSUMER_BATCH_SIZE", 500))
+batch_timeout = float(os.environ.get("CONSUMER_BATCH_TIMEOUT", 1.0))
+
+# trainer_stats holds the aggregates served by the API, with an index per
+# leaderboard order. trainer_pokemon and species_caught hold the state
+# needed to update them incrementally.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trainer_stats (
+    trainer TEXT PRIMARY KEY,
+    pokemon_count INTEGER NOT NULL,
+    caught INTEGER NOT NULL,
+    level_sum INTEGER NOT NULL,
+    average_level REAL,
+    max_level INTEGER,
+    most_caught_species TEXT,
+    most_caught_species_count INTEGER NOT NULL,
+    last_activity REAL
+);
+CREATE INDEX IF NOT EXISTS trainer_stats_pokemon_count
+    ON trainer_stats (pokemon_count DESC, trainer);
+CREATE INDEX IF NOT EXISTS trainer_stats_caught
+    ON trainer_stats (caught DESC, trainer);
+CREATE INDEX IF NOT EXISTS trainer_stats_average_level
+    ON trainer_stats (average_level DESC, trainer);
+CREATE INDEX IF NOT EXISTS trainer_stats_max_level
+    ON trainer_stats (max_level DESC, trainer);
+CREATE INDEX IF NOT EXISTS trainer_stats_last_activity
+    ON trainer_stats (last_activity DESC, trainer);
+CREATE TABLE IF NOT EXISTS trainer_pokemon (
+    trainer TEXT NOT NULL,
+    name TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (trainer, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS trainer_pokemon_level
+    ON trainer_pokemon (trainer, level);
+CREATE TABLE IF NOT EXISTS species_caught (
+    trainer TEXT NOT NULL,
+    species TEXT NOT NULL,
+    caught INTEGER NOT NULL,
+    PRIMARY KEY (trainer, species)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS consumer_offsets (
+    topic TEXT NOT NULL,
+    partition INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (topic, partition)
+);
+"""
+
+STATS_COLUMNS = ("pokemon_count", "caught", "level_sum", "max_level",
+                 "most_caught_species", "most_caught_species_count",
+                 "last_activity")
+
+Event = Tuple[str, int, int, dict]
+
+
+class TrainerStatsStore:
+    """SQLite store of the statistics of each trainer, in WAL mode so the
+    API reads them while they are updated.
+
+    Each pokemon event updates the statistics of its trainer in a constant
+    amount of statements: the level of a pokemon is set to the one in the
+    event, unless a later event already set it, and the maximum level is
+    only looked up again, through an index, when the pokemon that had it
+    is lowered.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=30)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self.offsets: Dict[Tuple[str, int], int] = {
+            (row["topic"], row["partition"]): row["offset"]
+            for row in self._connection.execute(
+                "SELECT * FROM consumer_offsets")
+        }
+
+    def apply(self, events: List[Event]) -> int:
+        """Apply `events`, as ``(topic, partition, offset, message)``, in a
+        single transaction, skipping the ones already applied.
+
+        Returns
+        -------
+        int
+            Amount of applied events.
+        """
+        offsets = {}
+        applied = 0
+        with self._connection:
+            for topic, partition, offset, message in events:
+                key = (topic, partition)
+                if offset <= offsets.get(key, self.offsets.get(key, -1)):
+                    continue
+                self._apply(topic, message)
+                offsets[key] = offset
+                applied += 1
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO consumer_offsets "
+                "(topic, partition, offset) VALUES (?, ?, ?)",
+                [(topic, partition, offset)
+                 for (topic, partition), offset in offsets.items()]
+            )
+        self.offsets.update(offsets)
+        return applied
+
+    def close(self):
+        self._connection.close()
+
+    def _apply(self, topic: str, message: dict):
+        response = message.get("response")
+        if message["response_status"] != 201 or not response:
+            return
+        timestamp = event_time(message)
+        if topic == BATCH_TOPIC:
+            for result in response.get("results", ()):
+                if result["status_code"] == 201:
+                    self._update(result["pokemon"], timestamp, caught=True)
+        else:
+            self._update(response, timestamp, caught=topic == REGISTER_TOPIC)
+
+    def _update(self, pokemon: dict, timestamp: float, caught: bool):
+        trainer, name, level = \
+            pokemon["trainer"], pokemon["name"], pokemon["level"]
+        stats = self._stats(trainer)
+        row = self._connection.execute(
+            "SELECT level, updated_at FROM trainer_pokemon "
+            "WHERE trainer = ? AND name = ?", (trainer, name)
+        ).fetchone()
+
+        if row is None:
+            self._connection.execute(
+                "INSERT INTO trainer_pokemon (trainer, name, level, "
+                "updated_at) VALUES (?, ?, ?, ?)",
+                (trainer, name, level, timestamp))
+            stats["pokemon_count"] += 1
+            stats["level_sum"] += level
+            stats["max_level"] = level if stats["max_level"] is None \
+                else max(stats["max_level"], level)
+        elif row["updated_at"] <= timestamp:
+            self._connection.execute(
+                "UPDATE trainer_pokemon SET level = ?, updated_at = ? "
+                "WHERE trainer = ? AND name = ?",
+                (level, timestamp, trainer, name))
+            stats["level_sum"] += level - row["level"]
+            if level >= stats["max_level"]:
+                stats["max_level"] = level
+            elif row["level"] == stats["max_level"]:
+                stats["max_level"] = self._connection.execute(
+                    "SELECT MAX(level) FROM trainer_pokemon "
+                    "WHERE trainer = ?", (trainer,)
+                ).fetchone()[0]
+
+        if caught:
+            stats["caught"] += 1
+            self._connection.execute(
+                "INSERT INTO species_caught (trainer, species, caught) "
+                "VALUES (?, ?, 1) ON CONFLICT (trainer, species) "
+                "DO UPDATE SET caught = caught + 1", (trainer, name))
+            species_caught = self._connection.execute(
+                "SELECT caught FROM species_caught "
+                "WHERE trainer = ? AND species = ?", (trainer, name)
+            ).fetchone()[0]
+            if species_caught > stats["most_caught_species_count"]:
+                stats["most_caught_species"] = name
+                stats["most_caught_species_count"] = species_caught
+
+        stats["last_activity"] = max(stats["last_activity"] or timestamp,
+                                     timestamp)
+        self._connection.execute(
+            f"INSERT OR REPLACE INTO trainer_stats "
+            f"(trainer, average_level, {', '.join(STATS_COLUMNS)}) "
+            f"VALUES (?, ?, {', '.join('?' for _ in STATS_COLUMNS)})",
+            (trainer, stats["level_sum"] / stats["pokemon_count"],
+             *(stats[column] for column in STATS_COLUMNS))
+        )
+
+    def _stats(self, trainer: str) -> dict:
+        row = self._connection.execute(
+            f"SELECT {', '.join(STATS_COLUMNS)} FROM trainer_stats "
+            f"WHERE trainer = ?", (trainer,)
+        ).fetchone()
+        if row is None:
+            return {
+                "pokemon_count": 0, "caught": 0, "level_sum": 0,
+                "max_level": None, "most_caught_species": None,
+                "most_caught_species_count": 0, "last_activity": None
+            }
+        return dict(row)
+
+
+def _setup_consumer() -> Consumer:
+    kafka_endpoint = os.environ.get("KAFKA_ENDPOINT", "localhost:19092")
+    conf = {'bootstrap.servers': kafka_endpoint,
+            'group.id': group_id,
+            'auto.offset.reset': 'smallest',
+            'enable.auto.commit': False}
+    return Consumer(conf)
+
+
+def consumer_loop(consumer: Consumer, store: TrainerStatsStore):
+    def on_assign(consumer, partitions):
+        # Resume after the last offset applied to the store, whatever was
+        # committed to Kafka.
+        for partition in partitions:
+            offset = store.offsets.get((partition.topic, partition.partition))
+            if offset is not None:
+                partition.offset = offset + 1
+        consumer.assign(partitions)
+        logger.info(f"Assigned partitions - "
+                    f"{format_partitions(partitions)}")
+
+    try:
+        consumer.subscribe(TOPICS, on_assign=on_assign)
+        while True:
+            msgs = consumer.consume(num_messages=batch_size,
+                                    timeout=batch_timeout)
+            if not msgs:
+                continue
+            events = []
+            for msg in msgs:
+                if msg.error():
+                    raise KafkaException(msg.error())
+                events.append((msg.topic(), msg.partition(), msg.offset(),
+                               decode_message(msg.value())))
+            applied = store.apply(events)
+            logger.debug(f"Applied {applied} of {len(events)} messages.")
+            # Only informative, e.g. for lag monitoring, as consumption
+            # resumes from the offsets in the store.
+            consumer.commit(asynchronous=True)
+    finally:
+        consumer.close()
+
+
+def run(store: Optional[TrainerStatsStore] = None):
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    store = store or TrainerStatsStore(stats_path)
+
+    retries = 0
+    try:
+        while True:
+            try:
+                consumer = _setup_consumer()
+                logger.info(f"Materializing topics - {TOPICS} - into "
+                            f"{store.path}")
+                consumer_loop(consumer, store)
+            except Exception as e:
+                logger.error(str(e))
+                retries = retries + 1
+                if retries > 5:
+                    break
+                time.sleep(30)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    run()
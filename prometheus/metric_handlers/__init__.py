@@ -0,0 +1,65 @@
+"""Handlers turning messages of specific endpoints into metrics.
+
+Every module of this package with a ``handler(message)`` function is
+discovered at startup. By default, a module handles the endpoint matching
+its name, the same way the API names its topics (``pokemon__random``
+handles ``/pokemon/random``). A module may handle other endpoints by
+listing them in an ``ENDPOINTS`` attribute, and several modules may handle
+the same endpoint.
+"""
+import importlib
+import logging
+import pkgutil
+import time
+from typing import Callable, Dict, List
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+handler_duration = Histogram(
+    "mpa_exporter_handler_duration_seconds",
+    "Execution time of each metric handler",
+    ["handler"],
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.1))
+
+handler_errors = Counter(
+    "mpa_exporter_handler_errors_total",
+    "Messages that a metric handler failed to handle",
+    ["handler"])
+
+
+def endpoint_of(module_name: str) -> str:
+    return "/" + module_name.replace("__", "/")
+
+
+def discover() -> Dict[str, List[Callable[[dict], None]]]:
+    """Import the handler modules and index their handlers by endpoint."""
+    registry: Dict[str, List[Callable[[dict], None]]] = {}
+    for module_info in pkgutil.iter_modules(__path__):
+        module = importlib.import_module(f"{__name__}.{module_info.name}")
+        handler = getattr(module, "handler", None)
+        if handler is None:
+            continue
+        endpoints = getattr(
+            module, "ENDPOINTS", [endpoint_of(module_info.name)])
+        for endpoint in endpoints:
+            registry.setdefault(endpoint, []).append(
+                _timed(module_info.name, handler))
+    return registry
+
+
+def _timed(name: str, handler: Callable[[dict], None]):
+    duration = handler_duration.labels(handler=name)
+    errors = handler_errors.labels(handler=name)
+
+    def wrapper(message: dict):
+        start_time = time.perf_counter()
+        try:
+            handler(message)
+        except Exception as e:
+            errors.inc()
+            logger.warning(f"Handler {name} failed - {e!r}")
+        duration.observe(time.perf_counter() - start_time)
+
+    return wrapper
@@ -1,9 +1,13 @@
 from prometheus_client import Counter
 
-request_count = Counter(
-    "mpa_pokemon__random_request_count",
-    "Request count to the /pokemon/random endpoint on the MPA API.",
-    ["id", "request_type", "status_code"])
+from cardinality import CardinalityLimiter
+
+request_count = CardinalityLimiter(
+    Counter(
+        "mpa_pokemon__random_request_count",
+        "Request count to the /pokemon/random endpoint on the MPA API.",
+        ["id", "request_type", "status_code"]),
+    overflow_labels=["id"])
 
 
 def handler(message: dict):
@@ -0,0 +1,23 @@
+from collections import Counter as ResultCounter
+
+from prometheus_client import Counter, Histogram
+
+batch_size = Histogram(
+    "mpa_trainers_pokemon_batch_size",
+    "Amount of pokemon per batch registration",
+    buckets=(1, 5, 10, 50, 100, 500, 1000, 5000))
+
+batch_items = Counter(
+    "mpa_trainers_pokemon_batch_items_total",
+    "Pokemon of batch registrations, by result",
+    ["status_code"])
+
+
+def handler(message: dict):
+    results = message["response"].get("results")
+    if results is None:
+        return
+    batch_size.observe(len(results))
+    for status_code, count in ResultCounter(
+            result["status_code"] for result in results).items():
+        batch_items.labels(status_code=status_code).inc(count)
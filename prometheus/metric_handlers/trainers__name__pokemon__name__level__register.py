@@ -1,12 +1,19 @@
 from prometheus_client import Gauge
 
-level = Gauge(
-    "mpa_trainers_pokemon_level",
-    "Level of a given trainer's pokemon",
-    ["trainer", "pokemon"])
+from cardinality import CardinalityLimiter
+
+level = CardinalityLimiter(
+    Gauge(
+        "mpa_trainers_pokemon_level",
+        "Level of a given trainer's pokemon",
+        ["trainer", "pokemon"],
+        multiprocess_mode="mostrecent"))
 
 
 def handler(message: dict):
+    # Failed level ups, e.g. of unregistered pokemon, carry an error.
+    if not 200 <= message["response_status"] < 300:
+        return
     trainer = message["response"]["trainer"]
     pokemon = message["response"]["name"]
     new_level = message["response"]["level"]
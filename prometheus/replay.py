@@ -0,0 +1,217 @@
+"""Rebuild the metrics of the server from the history of the Kafka topics.
+
+Messages are consumed in batches, as fast as the broker serves them, from a
+given time or offset up to the end of each partition at startup, and handled
+by the same code as the server. The resulting metrics are written to a file
+in the Prometheus or OpenMetrics exposition format::
+
+    python replay.py --since 2022-11-20T00:00:00 --output metrics.prom
+
+Topics, or single partitions, can start from their own offset or time, e.g.
+to resume each partition where a previous replay stopped::
+
+    python replay.py --start POKEMON__ID:0=1500 --start POKEMON__ID:1=1420 \
+        --start TRAINERS__NAME=2022-11-20T00:00:00 --output metrics.prom
+
+Windowed metrics are aggregated by the time of the original requests, so
+only the ones still within the windows are kept.
+"""
+import argparse
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Optional, Tuple, Union
+
+from confluent_kafka import (
+    Consumer, KafkaException, TopicPartition, OFFSET_BEGINNING
+)
+from prometheus_client import REGISTRY, write_to_textfile
+from prometheus_client.openmetrics.exposition import generate_latest
+
+import kafka as exporter
+
+logger = exporter.logger
+
+# Start position of a topic, or of one of its partitions, as an offset or a
+# time, keyed by topic and partition, which is None for every partition.
+StartPositions = Dict[Tuple[str, Optional[int]], Union[int, datetime]]
+
+
+def parse_start(value: str) -> Tuple[Tuple[str, Optional[int]],
+                                     Union[int, datetime]]:
+    """Parse a ``TOPIC[:PARTITION]=OFFSET|TIMESTAMP`` start position."""
+    key, separator, position = value.partition("=")
+    topic, _, partition = key.partition(":")
+    if not separator or not topic or not position:
+        raise argparse.ArgumentTypeError(
+            f"Invalid start position '{value}', expected "
+            f"TOPIC[:PARTITION]=OFFSET|TIMESTAMP.")
+    try:
+        partition = int(partition) if partition else None
+        position = int(position) if position.lstrip("-").isdigit() \
+            else datetime.fromisoformat(position)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(
+            f"Invalid start position '{value}': {e}")
+    return (topic, partition), position
+
+
+def _setup_consumer() -> Consumer:
+    kafka_endpoint = os.environ.get("KAFKA_ENDPOINT", "localhost:19092")
+    conf = {'bootstrap.servers': kafka_endpoint,
+            'group.id': f"mpa-replay-{uuid.uuid4().hex}",
+            'enable.auto.commit': False,
+            'auto.offset.reset': 'smallest',
+            'fetch.max.bytes': 52428800,
+            'queued.max.messages.kbytes': 262144}
+    return Consumer(conf)
+
+
+def _partitions(consumer: Consumer, topics: list) -> list:
+    metadata = consumer.list_topics(timeout=10)
+    return [
+        TopicPartition(topic, partition)
+        for topic in topics if topic in metadata.topics
+        for partition in metadata.topics[topic].partitions
+    ]
+
+
+def _start_offsets(consumer: Consumer, partitions: list,
+                   since: datetime = None, offset: int = None,
+                   starts: StartPositions = None) -> list:
+    starts = starts or {}
+    default = since if since is not None else \
+        OFFSET_BEGINNING if offset is None else offset
+    offsets, times = [], []
+    for p in partitions:
+        position = starts.get((p.topic, p.partition),
+                              starts.get((p.topic, None), default))
+        if isinstance(position, datetime):
+            timestamp = int(position.timestamp() * 1000)
+            times.append(TopicPartition(p.topic, p.partition, timestamp))
+        else:
+            offsets.append(TopicPartition(p.topic, p.partition, position))
+    if times:
+        offsets += consumer.offsets_for_times(times, timeout=10)
+    return offsets
+
+
+def replay(consumer: Consumer, topics: list, since: datetime = None,
+           offset: int = None, batch_size: int = 10000,
+           starts: StartPositions = None) -> int:
+    """Handle every message of `topics` from `since` or `offset` up to the
+    end of each partition when the replay starts.
+
+    Topics and partitions in `starts` start from their own position
+    instead, the one of a partition taking precedence over the one of its
+    topic.
+
+    Returns
+    -------
+    int
+        Amount of replayed messages.
+    """
+    partitions = _partitions(consumer, topics)
+    end_offsets = {}
+    for partition in partitions:
+        low, high = consumer.get_watermark_offsets(partition, timeout=10)
+        if high > low:
+            end_offsets[(partition.topic, partition.partition)] = high
+
+    assignment = []
+    for partition in _start_offsets(consumer, partitions, since, offset,
+                                    starts):
+        key = (partition.topic, partition.partition)
+        if key not in end_offsets:
+            continue
+        # An offset of -1 from offsets_for_times means there are no
+        # messages after the given time.
+        if partition.offset == -1 or end_offsets[key] <= partition.offset:
+            del end_offsets[key]
+        else:
+            assignment.append(partition)
+    if not assignment:
+        return 0
+    consumer.assign(assignment)
+
+    replayed = 0
+    start_time = last_report = time.perf_counter()
+    while end_offsets:
+        msgs = consumer.consume(num_messages=batch_size, timeout=1.0)
+        values = []
+        for msg in msgs:
+            if msg.error():
+                raise KafkaException(msg.error())
+            key = (msg.topic(), msg.partition())
+            end_offset = end_offsets.get(key)
+            if end_offset is None or msg.offset() >= end_offset:
+                continue
+            values.append(exporter.decode_message(msg.value()))
+            if msg.offset() >= end_offset - 1:
+                del end_offsets[key]
+                consumer.pause([TopicPartition(*key)])
+        exporter.handle_batch(values)
+        replayed += len(values)
+        if not msgs:
+            _drop_finished(consumer, end_offsets)
+
+        now = time.perf_counter()
+        if now - last_report >= 5:
+            logger.info(f"Replayed {replayed} messages - "
+                        f"{replayed / (now - start_time):.0f} events/s")
+            last_report = now
+
+    elapsed_time = time.perf_counter() - start_time
+    logger.info(f"Replayed {replayed} messages in {elapsed_time:.2f}s - "
+                f"{replayed / elapsed_time:.0f} events/s")
+    return replayed
+
+
+def _drop_finished(consumer: Consumer, end_offsets: dict):
+    # The last offsets of a partition may not hold a message, e.g. after
+    # compaction, so partitions are also finished by their position.
+    positions = consumer.position(
+        [TopicPartition(*key) for key in end_offsets])
+    for position in positions:
+        key = (position.topic, position.partition)
+        if position.offset >= end_offsets[key]:
+            del end_offsets[key]
+
+
+def write_metrics(path: str, exposition_format: str):
+    if exposition_format == "openmetrics":
+        with open(path, "wb") as f:
+            f.write(generate_latest(REGISTRY))
+    else:
+        write_to_textfile(path, REGISTRY)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument("--since", type=datetime.fromisoformat,
+                       help="Replay messages produced since this ISO time.")
+    start.add_argument("--offset", type=int,
+                       help="Replay messages from this offset of every "
+                            "partition. Defaults to the beginning.")
+    parser.add_argument("--start", type=parse_start, action="append",
+                        default=[], metavar="TOPIC[:PARTITION]=POSITION",
+                        help="Replay a topic, or one of its partitions, from "
+                             "this offset or ISO time instead. Repeatable.")
+    parser.add_argument("--topics", nargs="+", default=exporter.topics)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--output", required=True,
+                        help="File to write the rebuilt metrics to.")
+    parser.add_argument("--format", default="prometheus",
+                        choices=["prometheus", "openmetrics"])
+    args = parser.parse_args()
+
+    consumer = _setup_consumer()
+    try:
+        replay(consumer, args.topics, args.since, args.offset,
+               args.batch_size, dict(args.start))
+    finally:
+        consumer.close()
+    write_metrics(args.output, args.format)
+    logger.info(f"Metrics written to '{args.output}'.")
@@ -0,0 +1,160 @@
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from prometheus_client.core import GaugeMetricFamily
+
+
+class DDSketch:
+    """Streaming quantile sketch with a bounded relative error.
+
+    Values are counted in logarithmic bins, so any quantile is estimated
+    within `relative_accuracy` of its true value while keeping a fixed
+    amount of memory, regardless of how many values were added.
+
+    Parameters
+    ----------
+    relative_accuracy : float
+        Maximum relative error of the estimated quantiles.
+    max_bins : int
+        Maximum amount of bins. When exceeded, the lowest bins are merged,
+        which only affects the accuracy of the lowest quantiles.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float, count: int = 1):
+        self.count += count
+        if value <= 0:
+            self.zero_count += count
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def merge(self, other: "DDSketch"):
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def clear(self):
+        self.bins.clear()
+        self.zero_count = 0
+        self.count = 0
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        bins = sorted(self.bins.items())
+        for key, count in bins:
+            seen += count
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** bins[-1][0] / (self.gamma + 1)
+
+    def _collapse(self):
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_bins
+        merged = sum(self.bins.pop(key) for key in keys[:excess])
+        self.bins[keys[excess]] += merged
+
+
+class QuantileCollector:
+    """Prometheus collector exposing quantiles of a sketch per label set,
+    over a sliding window.
+
+    Like `windows.SlidingWindow`, each label set keeps a ring buffer of
+    sketches, one per slot of `slot_seconds`, which are reset when reused,
+    so quantiles follow recent latencies and memory stays constant. The
+    sketches of the slots within the window are merged when collected.
+
+    Parameters
+    ----------
+    name : str
+        Name of the exposed gauge.
+    documentation : str
+        Help text of the exposed gauge.
+    labelnames : iterable of str
+        Names of the labels identifying each sketch.
+    quantiles : iterable of float
+        Quantiles to expose, as the ``quantile`` label.
+    relative_accuracy : float
+        Relative accuracy of each sketch.
+    window : float
+        Length of the window, in seconds.
+    slot_seconds : float
+        Granularity of the window, in seconds.
+    """
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Iterable[str],
+                 quantiles: Iterable[float] = (0.5, 0.9, 0.95, 0.99),
+                 relative_accuracy: float = 0.01, window: float = 600,
+                 slot_seconds: float = 60):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = list(labelnames)
+        self.quantiles = list(quantiles)
+        self.relative_accuracy = relative_accuracy
+        self.window = window
+        self.slot_seconds = slot_seconds
+        self.slot_count = max(int(window // slot_seconds), 1)
+        # Ring buffer of (slot index, sketch) per label set.
+        self.sketches: Dict[Tuple, List[Tuple[int, DDSketch]]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, labelvalues: Iterable, values: Iterable[float],
+            now: Optional[float] = None):
+        """Add `values` to the sketch of a label set, in the slot of `now`,
+        which defaults to the current time."""
+        labelvalues = tuple(str(value) for value in labelvalues)
+        index = int((time.time() if now is None else now)
+                    // self.slot_seconds)
+        with self._lock:
+            slots = self.sketches.get(labelvalues)
+            if slots is None:
+                slots = self.sketches[labelvalues] = [
+                    (-1, DDSketch(self.relative_accuracy))
+                    for _ in range(self.slot_count)
+                ]
+            slot_index, sketch = slots[index % self.slot_count]
+            if slot_index > index:
+                # Older than the window.
+                return
+            if slot_index != index:
+                sketch.clear()
+                slots[index % self.slot_count] = (index, sketch)
+            for value in values:
+                sketch.add(value)
+
+    def collect(self):
+        family = GaugeMetricFamily(
+            self.name, self.documentation,
+            labels=self.labelnames + ["quantile"])
+        first_index = int(time.time() // self.slot_seconds) - \
+            self.slot_count + 1
+        with self._lock:
+            for labelvalues, slots in self.sketches.items():
+                sketch = DDSketch(self.relative_accuracy)
+                for slot_index, slot_sketch in slots:
+                    if slot_index >= first_index:
+                        sketch.merge(slot_sketch)
+                for q in self.quantiles:
+                    family.add_metric(
+                        list(labelvalues) + [str(q)], sketch.quantile(q))
+        yield family
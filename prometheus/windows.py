@@ -0,0 +1,148 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from prometheus_client.core import GaugeMetricFamily
+
+from sketch import DDSketch
+
+
+class _Slot:
+    __slots__ = ("index", "count", "errors", "sketch")
+
+    def __init__(self, relative_accuracy: float):
+        self.index = -1
+        self.count = 0
+        self.errors = 0
+        self.sketch = DDSketch(relative_accuracy)
+
+    def reset(self, index: int):
+        self.index = index
+        self.count = 0
+        self.errors = 0
+        self.sketch.clear()
+
+
+class SlidingWindow:
+    """Request counts, errors and latencies over a sliding time window.
+
+    Values are kept in a ring buffer of fixed width slots, so memory stays
+    constant no matter the rate of requests. Shorter windows are computed
+    from the most recent slots of the same buffer.
+
+    Parameters
+    ----------
+    length : float
+        Length of the longest window, in seconds.
+    slot_seconds : float
+        Width of each slot, in seconds.
+    relative_accuracy : float
+        Relative accuracy of the latency quantiles.
+    """
+
+    def __init__(self, length: float, slot_seconds: float,
+                 relative_accuracy: float = 0.01):
+        self.slot_seconds = slot_seconds
+        self.slots = [
+            _Slot(relative_accuracy)
+            for _ in range(int(length // slot_seconds))
+        ]
+        self.relative_accuracy = relative_accuracy
+
+    def add(self, elapsed_time: float, error: bool, now: float):
+        index = int(now // self.slot_seconds)
+        slot = self.slots[index % len(self.slots)]
+        if slot.index > index:
+            # Older than the window.
+            return
+        if slot.index != index:
+            slot.reset(index)
+        slot.count += 1
+        slot.errors += error
+        slot.sketch.add(elapsed_time)
+
+    def totals(self, length: float, now: float):
+        """Return the count, errors and latency sketch of the last `length`
+        seconds."""
+        first_index = int((now - length) // self.slot_seconds) + 1
+        count = errors = 0
+        sketch = DDSketch(self.relative_accuracy)
+        for slot in self.slots:
+            if slot.index >= first_index:
+                count += slot.count
+                errors += slot.errors
+                sketch.merge(slot.sketch)
+        return count, errors, sketch
+
+
+class WindowedAggregator:
+    """Prometheus collector of per-endpoint rates, error ratios and latency
+    quantiles over sliding windows.
+
+    Parameters
+    ----------
+    windows : iterable of float
+        Length of each window, in seconds.
+    slot_seconds : float
+        Granularity of the windows, in seconds.
+    quantiles : iterable of float
+        Latency quantiles to expose.
+    """
+
+    def __init__(self, windows: Iterable[float] = (60, 300),
+                 slot_seconds: float = 5,
+                 quantiles: Iterable[float] = (0.5, 0.95, 0.99)):
+        self.windows: List[float] = sorted(windows)
+        self.slot_seconds = slot_seconds
+        self.quantiles = list(quantiles)
+        self.endpoints: Dict[str, SlidingWindow] = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, status_code: int, elapsed_time: float,
+            start_time: Optional[float] = None):
+        """Add a response to the windows of the time its request started,
+        which defaults to the current time."""
+        now = time.time() if start_time is None else start_time
+        with self._lock:
+            window = self.endpoints.get(endpoint)
+            if window is None:
+                window = self.endpoints[endpoint] = SlidingWindow(
+                    self.windows[-1], self.slot_seconds)
+            window.add(elapsed_time, status_code >= 400, now)
+
+    def collect(self):
+        labels = ["endpoint", "window"]
+        rate = GaugeMetricFamily(
+            "mpa_endpoint_request_rate",
+            "Requests per second to each endpoint over a sliding window",
+            labels=labels)
+        error_ratio = GaugeMetricFamily(
+            "mpa_endpoint_error_ratio",
+            "Ratio of error responses of each endpoint over a sliding window",
+            labels=labels)
+        latency = GaugeMetricFamily(
+            "mpa_endpoint_latency_seconds",
+            "Response time quantiles of each endpoint over a sliding window",
+            labels=labels + ["quantile"])
+
+        now = time.time()
+        with self._lock:
+            for endpoint, window in self.endpoints.items():
+                for length in self.windows:
+                    count, errors, sketch = window.totals(length, now)
+                    label_values = [endpoint, _window_label(length)]
+                    rate.add_metric(label_values, count / length)
+                    error_ratio.add_metric(
+                        label_values, errors / count if count else 0.0)
+                    for q in self.quantiles:
+                        latency.add_metric(
+                            label_values + [str(q)], sketch.quantile(q))
+        yield rate
+        yield error_ratio
+        yield latency
+
+
+def _window_label(length: float) -> str:
+    if length % 60 == 0:
+        return f"{int(length // 60)}m"
+    return f"{int(length)}s"
@@ -5,5 +5,5 @@ docker-compose $COMPOSE_FILES up -d --build
 sleep 15
 
 for topic in $(cat ./topics.txt); do
-    docker exec broker kafka-topics --bootstrap-server broker:9092 --create --topic $topic
+    docker exec broker kafka-topics --bootstrap-server broker:9092 --create --topic $topic --partitions ${TOPIC_PARTITIONS:-1}
 done